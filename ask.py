@@ -5,13 +5,36 @@ import os
 
 # You'll need to install the 'requests' library: pip install requests
 
+def stream_answer(response):
+    """
+    Reads Server-Sent Events from /ask/stream and prints tokens as they arrive.
+    """
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: "):])
+            if event == "chunks":
+                print("\nRetrieved Chunks:")
+                for i, chunk_text in enumerate(data.get("retrieved_chunks", [])):
+                    print(f"  Chunk {i+1}: {str(chunk_text)[:100]}...")
+                print("\nAnswer: ", end="", flush=True)
+            elif event == "token":
+                print(data.get("text", ""), end="", flush=True)
+            elif event == "done":
+                print("\n\nChat History:", data.get("chat_history"))
+            elif event == "error":
+                print(f"\nERROR: Server reported an error while streaming: {data.get('detail')}")
+
 def main():
     parser = argparse.ArgumentParser(description="Ask a question to the RAG pipeline.")
     parser.add_argument("query", type=str, help="The question to ask.")
+    parser.add_argument("--stream", action="store_true", help="Print the answer token by token as it is generated.")
     args = parser.parse_args()
 
     # Define the API endpoint URL
-    API_URL = "http://127.0.0.1:8000/ask"
+    API_URL = "http://127.0.0.1:8000/ask/stream" if args.stream else "http://127.0.0.1:8000/ask"
 
     # Create the payload for the POST request
     payload = {
@@ -22,6 +45,12 @@ def main():
     print(f"DEBUG: Attempting to send POST request to {API_URL} with payload: {payload}") # Debug print
 
     try:
+        if args.stream:
+            response = requests.post(API_URL, json=payload, stream=True)
+            response.raise_for_status()
+            stream_answer(response)
+            return
+
         # THIS IS THE CRITICAL LINE: Using requests.post()
         response = requests.post(API_URL, json=payload)
         response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
@@ -0,0 +1,107 @@
+# ANN index benchmark: recall@k against exact search and p50/p99 latency as the corpus grows.
+# Needs the same PostgreSQL + pgvector instance as the app (see .env). Uses a scratch
+# table, so the live chunks table is never touched.
+#
+#   python -m bench.ann --sizes 1000 10000 50000 --index hnsw --ef-search 40 100
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from psycopg2.extras import execute_values
+from rag import db
+from bench.common import make_corpus, percentile_ms, recall_at_k
+
+BENCH_TABLE = 'ann_bench'
+DIM = 768
+
+
+def run_queries(cur, queries, top_k, setup_sql=()):
+    results, latencies = [], []
+    for q in queries:
+        started = time.perf_counter()
+        for sql in setup_sql:
+            cur.execute(sql)
+        cur.execute(
+            f"SELECT id FROM {BENCH_TABLE} ORDER BY embedding {db.DISTANCE_OPERATOR} %s::vector LIMIT %s;",
+            (q, top_k)
+        )
+        results.append([row[0] for row in cur.fetchall()])
+        latencies.append(time.perf_counter() - started)
+        cur.connection.rollback()
+    return results, latencies
+
+
+def _index_sql(args, lists):
+    if args.index == 'hnsw':
+        return (
+            f"CREATE INDEX ON {BENCH_TABLE} USING hnsw (embedding {db.DISTANCE_OPCLASS}) "
+            f"WITH (m = {args.m}, ef_construction = {args.ef_construction});"
+        )
+    return f"CREATE INDEX ON {BENCH_TABLE} USING ivfflat (embedding {db.DISTANCE_OPCLASS}) WITH (lists = {lists});"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pgvector ANN indexes against exact search.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--index', choices=['hnsw', 'ivfflat'], default=db.VECTOR_INDEX_TYPE if db.VECTOR_INDEX_TYPE != 'none' else 'hnsw')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=4)
+    parser.add_argument('--m', type=int, default=db.HNSW_M)
+    parser.add_argument('--ef-construction', type=int, default=db.HNSW_EF_CONSTRUCTION)
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[db.HNSW_EF_SEARCH])
+    parser.add_argument('--lists', type=int, default=db.IVFFLAT_LISTS)
+    parser.add_argument('--probes', type=int, nargs='+', default=[db.IVFFLAT_PROBES])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    conn = db.get_connection()
+    cur = conn.cursor()
+    try:
+        for n in args.sizes:
+            corpus = make_corpus(n, DIM, clusters=max(n // 100, 8), rng=rng)
+            queries = make_corpus(args.queries, DIM, clusters=8, rng=rng)
+            cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE};")
+            cur.execute(f"CREATE TABLE {BENCH_TABLE} (id INT PRIMARY KEY, embedding vector({DIM}));")
+            execute_values(cur, f"INSERT INTO {BENCH_TABLE} (id, embedding) VALUES %s", list(enumerate(corpus)), page_size=1000)
+            conn.commit()
+
+            exact, exact_lat = run_queries(cur, queries, args.top_k)
+
+            lists = args.lists or max(n // 1000, 1)
+            started = time.perf_counter()
+            cur.execute(_index_sql(args, lists))
+            conn.commit()
+            build_s = time.perf_counter() - started
+
+            if args.index == 'hnsw':
+                settings = [('ef_search', v, f"SET LOCAL hnsw.ef_search = {max(v, args.top_k)};") for v in args.ef_search]
+            else:
+                settings = [('probes', v, f"SET LOCAL ivfflat.probes = {v};") for v in args.probes]
+            for name, value, sql in settings:
+                approx, approx_lat = run_queries(cur, queries, args.top_k, setup_sql=[sql])
+                print(json.dumps({
+                    'corpus_size': n,
+                    'index': args.index,
+                    'opclass': db.DISTANCE_OPCLASS,
+                    'build_params': {'m': args.m, 'ef_construction': args.ef_construction} if args.index == 'hnsw' else {'lists': lists},
+                    name: value,
+                    'build_s': round(build_s, 3),
+                    f'recall@{args.top_k}': round(recall_at_k(approx, exact), 4),
+                    'exact_p50_ms': round(percentile_ms(exact_lat, 50), 3),
+                    'exact_p99_ms': round(percentile_ms(exact_lat, 99), 3),
+                    'ann_p50_ms': round(percentile_ms(approx_lat, 50), 3),
+                    'ann_p99_ms': round(percentile_ms(approx_lat, 99), 3),
+                }))
+    finally:
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE};")
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# Helpers shared by the synthetic vector benchmarks (bench.ann, bench.quantization).
+import numpy as np
+
+
+def make_corpus(n, dim, clusters, rng):
+    """
+    Clustered unit vectors: real embeddings are far from uniform, and uniform
+    random data makes approximate search recall look unrealistically bad.
+    """
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def recall_at_k(approx, exact):
+    return float(np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)]))
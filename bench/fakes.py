@@ -0,0 +1,149 @@
+# Deterministic local stand-ins for the Gemini APIs, used by bench/suite.py.
+#
+# FakeEmbeddingServer speaks the embedContent / batchEmbedContents REST protocol on
+# localhost, so rag.embedding runs unchanged against it via GEMINI_API_BASE.
+# FakeGenerativeModel replaces rag.generator.generation_model in-process.
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+DIM = 768
+
+_WORD = re.compile(r'[\u0980-\u09FF]+|\w+')
+
+
+def fake_embedding(text, dim=DIM):
+    """
+    Unit-length hashed bag of words: texts sharing words get similar vectors, so
+    retrieval over fake embeddings still ranks lexically related chunks first.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD.findall(text.casefold()):
+        digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], 'little') % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector.tolist()
+    return (vector / norm).tolist()
+
+
+class FakeEmbeddingServer:
+    """
+    Threaded HTTP server answering Gemini embedding requests after latency seconds
+    (plus per_item seconds per text in a batch). failure_rate is the fraction of
+    requests answered with a 503, to exercise the client's retry path.
+    """
+
+    def __init__(self, latency=0.05, per_item=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.per_item = per_item
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1beta"
+
+    def _fail(self):
+        with self._lock:
+            self.requests += 1
+            return self._random.random() < self.failure_rate
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if 'batchEmbedContents' in self.path:
+                    texts = [r['content']['parts'][0]['text'] for r in body['requests']]
+                else:
+                    texts = [body['content']['parts'][0]['text']]
+                time.sleep(fake.latency + fake.per_item * len(texts))
+                if fake._fail():
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if 'batchEmbedContents' in self.path:
+                    out = {"embeddings": [{"values": fake_embedding(t)} for t in texts]}
+                else:
+                    out = {"embedding": {"values": fake_embedding(texts[0])}}
+                payload = json.dumps(out).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _fake_response(prompt, text):
+    usage = SimpleNamespace(prompt_token_count=len(prompt.split()), candidates_token_count=len(text.split()))
+    return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+class FakeGenerativeModel:
+    """
+    Drop-in for genai.GenerativeModel: answers with the first line of the prompt's
+    context after latency seconds. Streaming yields stream_parts fragments spread
+    over the same latency.
+    """
+
+    def __init__(self, latency=0.3, stream_parts=5):
+        self.latency = latency
+        self.stream_parts = stream_parts
+
+    @staticmethod
+    def _answer(prompt):
+        context = prompt.split('Context:', 1)[-1].split('Question:', 1)[0].strip()
+        return context.splitlines()[0][:200] if context else "I cannot find the answer to your question in the provided context."
+
+    def generate_content(self, prompt, generation_config=None):
+        time.sleep(self.latency)
+        return _fake_response(prompt, self._answer(prompt))
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        if not stream:
+            await asyncio.sleep(self.latency)
+            return _fake_response(prompt, self._answer(prompt))
+        return self._stream(prompt)
+
+    async def _stream(self, prompt):
+        words = self._answer(prompt).split(' ')
+        size = max(len(words) // self.stream_parts, 1)
+        parts = [' '.join(words[i:i + size]) for i in range(0, len(words), size)]
+        for i, part in enumerate(parts):
+            await asyncio.sleep(self.latency / len(parts))
+            text = part if i == 0 else ' ' + part
+            yield _fake_response(prompt, text) if i == len(parts) - 1 else SimpleNamespace(text=text)
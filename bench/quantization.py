@@ -0,0 +1,135 @@
+# Quantized storage benchmark: memory of the searched representation, p50/p99 latency
+# and recall@k against exact float32 search for none/binary (numpy) or none/halfvec/binary
+# (pgvector) with exact re-ranking of top_k * rerank_factor candidates.
+#
+# The numpy backend runs anywhere. --backend pgvector uses the PostgreSQL instance from
+# .env (pgvector >= 0.7) and a scratch table, so the live chunks table is never touched;
+# there the reported size is that of the HNSW index built on the compact form.
+#
+#   python -m bench.quantization --sizes 10000 100000 --rerank-factors 2 4 10
+#   python -m bench.quantization --backend pgvector --sizes 10000 --kinds none halfvec binary
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from rag.vector_store import NumpyVectorStore, QUANTIZATIONS, quantize
+from bench.common import make_corpus, percentile_ms, recall_at_k
+
+BENCH_TABLE = 'quantization_bench'
+# Mirrors rag.db.QUANTIZED_INDEXES, which needs psycopg2 to import
+PGVECTOR_QUANTIZATIONS = ('none', 'halfvec', 'binary')
+DIM = 768
+
+
+def _timed(search, queries):
+    results, latencies = [], []
+    for q in queries:
+        started = time.perf_counter()
+        results.append(search(q))
+        latencies.append(time.perf_counter() - started)
+    return results, latencies
+
+
+def bench_numpy(corpus, queries, args):
+    with tempfile.TemporaryDirectory(prefix='quant-bench-') as path:
+        NumpyVectorStore(path, quantization='none').replace_document('bench', [
+            (i, str(i), vector) for i, vector in enumerate(corpus)
+        ])
+        exact_store = NumpyVectorStore(path, quantization='none')
+        exact, exact_lat = _timed(lambda q: [r[0] for r in exact_store.search(q, top_k=args.top_k)], queries)
+        for kind in args.kinds:
+            codes = quantize(corpus, kind)
+            size = corpus.nbytes if codes is None else sum(a.nbytes for a in codes)
+            for factor in (args.rerank_factors if kind != 'none' else [1]):
+                store = NumpyVectorStore(path, quantization=kind, rerank_factor=factor)
+                store.search(queries[0], top_k=args.top_k)  # Loads and quantizes outside the timing
+                approx, lat = _timed(lambda q: [r[0] for r in store.search(q, top_k=args.top_k)], queries)
+                yield kind, factor, size, approx, lat, exact, exact_lat
+
+
+def bench_pgvector(corpus, queries, args):
+    from psycopg2.extras import execute_values
+    from rag import db
+    conn = db.get_connection()
+    cur = conn.cursor()
+
+    def search(q, kind, factor):
+        cur.execute(f"SET LOCAL hnsw.ef_search = {max(db.HNSW_EF_SEARCH, args.top_k * factor)};")
+        cur.execute(
+            db._top_k_sql('%(q)s::vector', '%(k)s', quantization=kind, source=BENCH_TABLE, columns='id', rerank_factor=factor) + ';',
+            {'q': q, 'k': args.top_k}
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+        return ids
+
+    try:
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE};")
+        cur.execute(f"CREATE TABLE {BENCH_TABLE} (id INT PRIMARY KEY, embedding vector({DIM}));")
+        execute_values(cur, f"INSERT INTO {BENCH_TABLE} (id, embedding) VALUES %s", list(enumerate(corpus)), page_size=1000)
+        conn.commit()
+        # Exact reference: a sequential scan before any ANN index exists
+        exact, exact_lat = _timed(lambda q: search(q, 'none', 1), queries)
+        for kind in args.kinds:
+            cur.execute(f"DROP INDEX IF EXISTS {BENCH_TABLE}_embedding_idx;")
+            cur.execute(db._vector_index_sql(BENCH_TABLE, 'hnsw', quantization=kind))
+            conn.commit()
+            cur.execute(f"SELECT pg_relation_size('{BENCH_TABLE}_embedding_idx');")
+            size = cur.fetchone()[0]
+            conn.rollback()
+            for factor in (args.rerank_factors if kind != 'none' else [1]):
+                approx, lat = _timed(lambda q: search(q, kind, factor), queries)
+                yield kind, factor, size, approx, lat, exact, exact_lat
+    finally:
+        conn.rollback()
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE};")
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized vector search with exact re-ranking.")
+    parser.add_argument('--backend', choices=['numpy', 'pgvector'], default='numpy')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--kinds', nargs='+', choices=PGVECTOR_QUANTIZATIONS, default=None, help="default: every kind the backend supports")
+    parser.add_argument('--rerank-factors', type=int, nargs='+', default=[2, 4, 10])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    supported = QUANTIZATIONS if args.backend == 'numpy' else PGVECTOR_QUANTIZATIONS
+    args.kinds = args.kinds or list(supported)
+    unsupported = [kind for kind in args.kinds if kind not in supported]
+    if unsupported:
+        parser.error(f"The {args.backend} backend does not support {', '.join(unsupported)}; choose from {', '.join(supported)}.")
+
+    rng = np.random.default_rng(args.seed)
+    run = bench_numpy if args.backend == 'numpy' else bench_pgvector
+    for n in args.sizes:
+        corpus = make_corpus(n, DIM, clusters=max(n // 100, 8), rng=rng)
+        # Queries near stored vectors, as real questions are near their answer chunks
+        queries = corpus[rng.integers(0, n, args.queries)] + 0.05 * rng.standard_normal((args.queries, DIM)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        for kind, factor, size, approx, lat, exact, exact_lat in run(corpus, queries, args):
+            print(json.dumps({
+                'backend': args.backend,
+                'corpus_size': n,
+                'quantization': kind,
+                'rerank_factor': factor if kind != 'none' else None,
+                'search_bytes': int(size),
+                'bytes_vs_float32': round(size / corpus.nbytes, 4),
+                f'recall@{args.top_k}': round(recall_at_k(approx, exact), 4),
+                'exact_p50_ms': round(percentile_ms(exact_lat, 50), 3),
+                'exact_p99_ms': round(percentile_ms(exact_lat, 99), 3),
+                'p50_ms': round(percentile_ms(lat, 50), 3),
+                'p99_ms': round(percentile_ms(lat, 99), 3),
+            }), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# Offline benchmark: ingestion throughput, /ask latency under concurrent load and
+# retrieval recall over bench/sample_qa.json. Gemini is replaced by the local fakes in
+# bench/fakes.py (configurable latency, deterministic output), and the corpus goes into
+# the in-process numpy store under a scratch directory. With --store pgvector the
+# database from .env is used instead; point DB_NAME at a scratch database, since the
+# benchmark document replaces any stored copy of the same PDF.
+#
+# Results are printed as one JSON document (and written to --output) so runs can be
+# diffed across commits:
+#
+#   python -m bench.suite --output bench-$(git rev-parse --short HEAD).json
+#   python -m bench.suite --requests 500 --concurrency 32 --generate-latency 0.5
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from bench.fakes import FakeEmbeddingServer, FakeGenerativeModel
+
+SAMPLE_QA_PATH = os.path.join(os.path.dirname(__file__), 'sample_qa.json')
+
+
+def _configure_env(args, workdir, embed_server):
+    # rag.* modules read their settings at import time, so this runs before importing them
+    os.environ['GEMINI_API_KEY'] = 'bench'
+    os.environ['GEMINI_API_BASE'] = embed_server.base_url
+    os.environ['VECTOR_STORE'] = args.store
+    os.environ['VECTOR_STORE_PATH'] = os.path.join(workdir, 'vector_store')
+    os.environ['EMBEDDING_CACHE_PATH'] = os.path.join(workdir, 'embedding_cache.sqlite3')
+    os.environ['PAGE_CACHE_PATH'] = os.path.join(workdir, 'page_cache.sqlite3')
+    os.environ['ANSWER_CACHE_ENABLED'] = '1' if args.answer_cache else '0'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _latency_summary(samples):
+    samples = np.asarray(samples) * 1000
+    if not len(samples):
+        return {}
+    return {
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'max_ms': round(float(samples.max()), 3),
+    }
+
+
+def bench_ingest(pdf_path):
+    """
+    Ingests the PDF twice: cold (empty page/embedding caches and store), then warm
+    (everything cached and the document unchanged).
+    """
+    from rag.pipeline import ingest
+    results = {}
+    for run in ('cold', 'warm'):
+        stats = ingest(pdf_path)
+        total = stats['total_s']
+        results[run] = {
+            **{k: round(v, 4) if isinstance(v, float) else v for k, v in stats.items()},
+            'pages_per_s': round(stats['pages'] / total, 2) if total else None,
+            'chunks_per_s': round(stats['chunks'] / total, 2) if total else None,
+            'embedded_chunks_per_s': round(stats['changed'] / stats['embed_s'], 2) if stats['embed_s'] else None,
+        }
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_api():
+    import uvicorn
+    from rag.main import app
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("API server failed to start.")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def _load(url, questions, count, concurrency, first=0):
+    import httpx
+    latencies, errors = [], 0
+    limiter = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        async def one(i):
+            nonlocal errors
+            # A numbered suffix makes every query distinct, so the query-embedding
+            # cache does not hide the embedding call
+            payload = {"user": f"bench_{i % concurrency}", "query": f"{questions[i % len(questions)]} ({i})"}
+            async with limiter:
+                started = time.perf_counter()
+                try:
+                    response = await client.post('/ask', json=payload)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                elapsed = time.perf_counter() - started
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(first, first + count)])
+        wall = time.perf_counter() - started
+    return latencies, errors, wall
+
+
+def bench_ask(questions, total, concurrency, warmup):
+    """
+    Drives POST /ask on a local uvicorn server with `concurrency` requests in flight.
+    Client-side latencies cover the whole HTTP round trip; `stages` is the server's
+    own per-stage breakdown (see /metrics/summary) for the measured requests.
+    """
+    from rag.metrics import metrics
+    server, thread, url = _start_api()
+    try:
+        if warmup:
+            asyncio.run(_load(url, questions, warmup, concurrency, first=total))
+        metrics.reset()
+        latencies, errors, wall = asyncio.run(_load(url, questions, total, concurrency))
+        snapshot = metrics.snapshot()
+    finally:
+        server.should_exit = True
+        thread.join()
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        **_latency_summary(latencies),
+        'stages': {
+            stage: {k: round(v, 3) if isinstance(v, float) else v for k, v in values.items()}
+            for stage, values in snapshot['stages'].items()
+        },
+        'counters': snapshot['counters'],
+    }
+
+
+def bench_recall(qa, top_k, modes):
+    """
+    recall@k and mrr per retrieval mode, scored by rag.evaluation's relevance_matrix
+    and rank_metrics so they match `python -m rag.evaluation`. Questions are retrieved
+    one at a time to measure per-query latency.
+    """
+    from rag.retriever import retrieve_relevant_chunks
+    from rag.evaluation import relevance_matrix, rank_metrics
+    results = {}
+    for mode in modes:
+        retrieved, latencies = [], []
+        for item in qa:
+            started = time.perf_counter()
+            retrieved.append(retrieve_relevant_chunks(item['question'], top_k=top_k, mode=mode))
+            latencies.append(time.perf_counter() - started)
+        ranks = rank_metrics(relevance_matrix(qa, retrieved, top_k))
+        results[mode] = {
+            f'recall@{top_k}': round(ranks['recall'], 4),
+            'mrr': round(ranks['mrr'], 4),
+            'hit_ranks': [int(r) if r >= 0 else None for r in ranks['first_ranks']],
+            **_latency_summary(latencies),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion, /ask latency and recall benchmark with fake Gemini APIs.")
+    parser.add_argument('--pdf', default=None, help="PDF to ingest (default: the bundled book)")
+    parser.add_argument('--qa', default=SAMPLE_QA_PATH)
+    parser.add_argument('--store', choices=['numpy', 'pgvector'], default='numpy')
+    parser.add_argument('--workdir', default=None, help="Directory for the store and caches (default: a temporary one)")
+    parser.add_argument('--embed-latency', type=float, default=0.05, help="Seconds per fake embedding request")
+    parser.add_argument('--embed-per-item', type=float, default=0.001, help="Extra seconds per text in a batch request")
+    parser.add_argument('--embed-failure-rate', type=float, default=0.0)
+    parser.add_argument('--generate-latency', type=float, default=0.3, help="Seconds per fake generation call")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--top-k', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', default=['vector', 'hybrid', 'lexical'])
+    parser.add_argument('--answer-cache', action='store_true', help="Leave the answer cache on during the load test")
+    parser.add_argument('--skip', nargs='*', default=[], choices=['ingest', 'ask', 'recall'])
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    embed_server = FakeEmbeddingServer(args.embed_latency, args.embed_per_item, args.embed_failure_rate).start()
+    tmp = tempfile.TemporaryDirectory(prefix='rag-bench-') if args.workdir is None else None
+    workdir = args.workdir or tmp.name
+    _configure_env(args, workdir, embed_server)
+
+    from rag import generator
+    generator.generation_model = FakeGenerativeModel(args.generate_latency)
+    from rag.evaluation import load_qa
+    qa = load_qa(args.qa)
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'workdir')},
+    }
+    try:
+        if 'ingest' not in args.skip:
+            report['ingest'] = bench_ingest(args.pdf)
+        if 'ask' not in args.skip:
+            report['ask'] = bench_ask([item['question'] for item in qa], args.requests, args.concurrency, args.warmup)
+        if 'recall' not in args.skip:
+            report['recall'] = bench_recall(qa, args.top_k, args.modes)
+        report['embedding_server_requests'] = embed_server.requests
+    finally:
+        embed_server.stop()
+        if tmp is not None:
+            tmp.cleanup()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
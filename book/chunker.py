@@ -1,44 +1,108 @@
 import os
+import re
+import sys
+from collections import namedtuple
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from rag.log import get_logger
 
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 500
+log = get_logger(__name__)
 
-CLEANED_TEXT_PATH = os.path.join(os.path.dirname(__file__), 'cleaned_text.txt')
-CHUNKS_PATH = os.path.join(os.path.dirname(__file__), 'chunks.txt')
+# Sentence-aware chunking (chunk_sentences): budgets are in count_tokens units (words)
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '200'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '30'))
 
+# A Bangla or English word, or a single punctuation mark
+_TOKEN_PATTERN = re.compile(r'[\u0980-\u09FF]+|\w+|[^\w\s]')
+# Sentences end with the danda/double danda, '?' or '!', or a '.' followed by whitespace
+_SENTENCE_END = re.compile(r'(?:[\u0964\u0965?!]+|\.(?=\s|$))["\'\u2019\u201d)]*\s*')
 
-def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    chunks = []
+# char_start/char_end index into '\n'.join(non-empty pages); pages are 1-based and inclusive
+Chunk = namedtuple('Chunk', ['text', 'char_start', 'char_end', 'page_start', 'page_end'])
+
+
+def count_tokens(text):
+    """
+    Rough word count: whitespace-separated words plus punctuation marks. It is not
+    the model's tokenizer; a Bangla word is often several subword tokens, so real
+    embedding and prompt sizes are several times this count.
+    """
+    return sum(1 for _ in _TOKEN_PATTERN.finditer(text))
+
+
+def _split_sentences(text, max_tokens):
+    """
+    Yields (start, end, tokens) spans of the sentences in text. Sentences longer
+    than max_tokens (tables, lists without punctuation) are split at word
+    boundaries so no single span can overflow a chunk.
+    """
     start = 0
-    print(f"DEBUG: chunk_text received text of length: {len(text)}")
-    if len(text) == 0:
-        print("DEBUG: Input text to chunk_text is empty, returning no chunks.")
-        return []
-
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunk = text[start:end]
-        chunks.append(chunk)
-        print(f"DEBUG: Created chunk from index {start} to {end}. Current chunks count: {len(chunks)}")
-        if end == len(text):
-            print("DEBUG: Reached end of text for chunking. Breaking loop.")
-            break
-        start += chunk_size - overlap
-        if start >= len(text) and end < len(text): # Handle case where last chunk might not advance 'start' enough
-            print("DEBUG: Adjusted start index for last chunk. Breaking loop.")
-            break
-        if chunk_size - overlap <= 0 and len(text) > 0:
-            print("ERROR: Chunk size minus overlap is zero or negative. This will cause an infinite loop if text is not empty. Breaking.")
-            break
-    print(f"DEBUG: Final number of chunks generated by chunk_text: {len(chunks)}")
-    return chunks
-
-# The following __main__ block should be removed or commented out:
-# if __name__ == "__main__":
-#     with open(CLEANED_TEXT_PATH, 'r', encoding='utf-8') as f:
-#         text = f.read()
-#     chunks = chunk_text(text)
-#     with open(CHUNKS_PATH, 'w', encoding='utf-8') as f:
-#         for i, chunk in enumerate(chunks):
-#             f.write(f"---chunk_{i}---\n{chunk}\n")
-#     print(f"Chunked text into {len(chunks)} chunks. Saved to chunks.txt.")
\ No newline at end of file
+    for match in _SENTENCE_END.finditer(text):
+        if match.end() > start:
+            yield from _bounded_spans(text, start, match.end(), max_tokens)
+            start = match.end()
+    if start < len(text):
+        yield from _bounded_spans(text, start, len(text), max_tokens)
+
+
+def _bounded_spans(text, start, end, max_tokens):
+    span_start, tokens = start, 0
+    for match in _TOKEN_PATTERN.finditer(text, start, end):
+        if tokens == max_tokens:
+            yield span_start, match.start(), tokens
+            span_start, tokens = match.start(), 0
+        tokens += 1
+    if text[span_start:end].strip():
+        yield span_start, end, tokens
+
+
+def chunk_sentences(pages, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Packs whole sentences into chunks of at most max_tokens, repeating up to
+    overlap_tokens worth of trailing sentences at the start of the next chunk.
+
+    pages is an iterable of (page_number, cleaned_text), e.g. preprocess.iter_pages.
+    Yields Chunk records in one streaming pass; only the sentences of the current
+    chunk are held in memory.
+    """
+    if max_tokens <= 0 or overlap_tokens < 0 or overlap_tokens >= max_tokens:
+        raise ValueError("Need 0 <= overlap_tokens < max_tokens.")
+    window = []  # (start, end, tokens, page) of the sentences in the current chunk
+    window_tokens = 0
+    buffer, buffer_start = '', 0  # Document text from the first sentence in the window onwards
+    offset = 0
+
+    def emit():
+        first, last = window[0], window[-1]
+        # Sentence spans carry their trailing whitespace; the chunk ends at the last character
+        text = buffer[first[0] - buffer_start:last[1] - buffer_start].rstrip()
+        return Chunk(text, first[0], first[0] + len(text), first[3], last[3])
+
+    for page_number, page in pages:
+        if not page:
+            continue
+        if offset:
+            buffer += '\n'
+            offset += 1
+        buffer += page
+        for start, end, tokens in _split_sentences(page, max_tokens):
+            if window and window_tokens + tokens > max_tokens:
+                yield emit()
+                # Keep a tail of sentences within the overlap budget that still leaves room
+                kept, tail = 0, []
+                for sentence in reversed(window):
+                    if kept + sentence[2] > overlap_tokens or kept + sentence[2] + tokens > max_tokens:
+                        break
+                    tail.append(sentence)
+                    kept += sentence[2]
+                window = tail[::-1]
+                window_tokens = kept
+                new_start = window[0][0] if window else offset + start
+                buffer = buffer[new_start - buffer_start:]
+                buffer_start = new_start
+            window.append((offset + start, offset + end, tokens, page_number))
+            window_tokens += tokens
+        offset += len(page)
+
+    # The window always ends with at least one sentence that was never emitted
+    if window:
+        yield emit()
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import hashlib
+import threading
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', '1') == '1'
+PAGE_CACHE_PATH = os.getenv('PAGE_CACHE_PATH', os.path.join(DATA_DIR, 'page_cache.sqlite3'))
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PageCache:
+    """
+    SQLite cache of cleaned page text.
+
+    Pages are stored under (pdf_hash, page_number, cleaner_version) so an unchanged
+    PDF is served without opening it, and also indexed by a hash of the page's
+    content streams so a replaced PDF only re-parses the pages that changed.
+    """
+
+    def __init__(self, path=PAGE_CACHE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL;')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS documents (
+                pdf_hash TEXT NOT NULL,
+                cleaner_version INTEGER NOT NULL,
+                page_count INTEGER NOT NULL,
+                PRIMARY KEY (pdf_hash, cleaner_version)
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                pdf_hash TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                cleaner_version INTEGER NOT NULL,
+                page_hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (pdf_hash, page_number, cleaner_version)
+            );
+            CREATE INDEX IF NOT EXISTS pages_by_content ON pages (page_hash, cleaner_version);
+        ''')
+        self._conn.commit()
+
+    def get_document(self, pdf_hash, cleaner_version):
+        """
+        Returns [(page_number, text)] for a fully cached PDF, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_count FROM documents WHERE pdf_hash = ? AND cleaner_version = ?",
+                (pdf_hash, cleaner_version)
+            ).fetchone()
+            if row is None:
+                return None
+            pages = self._conn.execute(
+                "SELECT page_number, text FROM pages WHERE pdf_hash = ? AND cleaner_version = ? ORDER BY page_number",
+                (pdf_hash, cleaner_version)
+            ).fetchall()
+        return pages if len(pages) == row[0] else None
+
+    def get_pages_by_content(self, page_hashes, cleaner_version):
+        """
+        Returns {page_hash: text} for the page content hashes already seen in any PDF.
+        """
+        found = {}
+        with self._lock:
+            hashes = list(set(page_hashes))
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT page_hash, text FROM pages WHERE cleaner_version = ? "
+                    f"AND page_hash IN ({','.join('?' * len(part))})",
+                    [cleaner_version, *part]
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_pages(self, pdf_hash, cleaner_version, pages):
+        """
+        Stores (page_number, page_hash, text) triples for one PDF.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (pdf_hash, page_number, cleaner_version, page_hash, text) VALUES (?, ?, ?, ?, ?)",
+                [(pdf_hash, n, cleaner_version, h, text) for n, h, text in pages]
+            )
+            self._conn.commit()
+
+    def put_document(self, pdf_hash, cleaner_version, page_count):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (pdf_hash, cleaner_version, page_count) VALUES (?, ?, ?)",
+                (pdf_hash, cleaner_version, page_count)
+            )
+            self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    """
+    Returns the shared PageCache, or None when caching is disabled.
+    """
+    global _cache
+    if not PAGE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PageCache()
+    return _cache
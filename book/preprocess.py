@@ -1,10 +1,29 @@
 import pdfplumber
 import re
 import os
+import sys
+import hashlib
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from pdfminer.pdftypes import resolve1, resolve_all, PDFObjRef, PDFStream
+from pdfminer.psparser import literal_name
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from book.page_cache import get_page_cache, file_hash
+from rag.log import get_logger
 # from langdetect import detect # Not used, can be commented out
 
+log = get_logger(__name__)
+
 PDF_PATH = os.path.join(os.path.dirname(__file__), 'hsc26_bangla_1st_paper.pdf')
 
+# Page extraction runs on a process pool; pdfplumber is pure Python and CPU bound
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '8'))
+
+# Bump whenever clean_text changes so cached pages are re-extracted
+CLEANER_VERSION = 1
+
 # Basic cleaning for Bangla and English
 BANGLA_UNICODE_RANGE = r"\u0980-\u09FF"
 ENGLISH_UNICODE_RANGE = r"A-Za-z"
@@ -20,29 +39,182 @@ def clean_text(text):
     return text
 
 
-def extract_text_from_pdf(pdf_path=PDF_PATH):
-    all_text = []
-    print(f"DEBUG: Attempting to open PDF: {pdf_path}")
+def _extract_pages(pdf_path, page_indexes):
+    """
+    Worker: extracts and cleans the given 0-based pages of the PDF.
+    Returns (page_number, cleaned_text) pairs with 1-based page numbers.
+    """
+    pages = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for i in page_indexes:
+            page = pdf.pages[i]
+            raw = page.extract_text() or ''
+            # Drop pdfplumber's per-page object cache so long ranges stay small
+            page.close()
+            pages.append((i + 1, clean_text(raw)))
+    return pages
+
+
+def _stream_digest(ref, digests):
+    """
+    sha256 of a stream's decoded data. Streams shared between pages (fonts, forms) are
+    hashed once per run through digests, keyed by object id.
+    """
+    key = ref.objid if isinstance(ref, PDFObjRef) else None
+    if key is not None and key in digests:
+        return digests[key]
+    stream = resolve1(ref)
+    digest = hashlib.sha256(stream.get_data()).hexdigest() if isinstance(stream, PDFStream) else ''
+    if key is not None:
+        digests[key] = digest
+    return digest
+
+
+def _hash_resources(h, resources, digests, seen):
+    """
+    Adds what the text of a resource dictionary depends on: each font's name, encoding
+    and ToUnicode map, and the content of Form XObjects, recursively.
+    """
+    resources = resolve1(resources) or {}
+    fonts = resolve1(resources.get('Font')) or {}
+    for name in sorted(fonts):
+        font = resolve1(fonts[name]) or {}
+        encoding = resolve_all(font.get('Encoding'))
+        h.update(f"{name}={resolve1(font.get('BaseFont'))};{encoding!r};".encode())
+        h.update(_stream_digest(font.get('ToUnicode'), digests).encode())
+    xobjects = resolve1(resources.get('XObject')) or {}
+    for name in sorted(xobjects):
+        ref = xobjects[name]
+        xobject = resolve1(ref)
+        # Images carry no text; a form is drawn like an inline content stream
+        if not isinstance(xobject, PDFStream) or literal_name(xobject.get('Subtype')) != 'Form':
+            continue
+        h.update(f"{name}:{_stream_digest(ref, digests)};".encode())
+        key = ref.objid if isinstance(ref, PDFObjRef) else id(xobject)
+        if key not in seen:
+            seen.add(key)
+            _hash_resources(h, xobject.get('Resources'), digests, seen)
+
+
+def _page_hash(page, digests=None):
+    """
+    Hash of what determines a page's text: its content streams, page box, fonts (with
+    their encodings and ToUnicode maps) and Form XObjects. Far cheaper than layout
+    analysis, so unchanged pages of a replaced PDF can be recognised without
+    extracting them. Pass the same digests dict for all pages of one PDF.
+    """
+    h = hashlib.sha256()
+    page_obj = page.page_obj
+    h.update(repr(page_obj.mediabox).encode())
+    _hash_resources(h, page_obj.resources, {} if digests is None else digests, set())
+    for stream in page_obj.contents:
+        h.update(resolve1(stream).get_data())
+    return h.hexdigest()
+
+
+def _extract_in_parallel(pdf_path, page_indexes, workers, pages_per_task):
+    """
+    Yields (page_number, cleaned_text) for page_indexes, in order, extracting
+    batches of pages_per_task on a process pool. At most two tasks per worker
+    are in flight, so memory stays bounded by the window rather than the document.
+    """
+    tasks = [page_indexes[i:i + pages_per_task] for i in range(0, len(page_indexes), pages_per_task)]
+    workers = max(1, min(workers or 1, len(tasks)))
+    if not tasks:
+        return
+    log.info("Extracting %d pages with %d worker(s).", len(page_indexes), workers)
+
+    if workers == 1:
+        for task in tasks:
+            yield from _extract_pages(pdf_path, task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(tasks)
+        pending = deque(executor.submit(_extract_pages, pdf_path, t) for t in islice(remaining, 2 * workers))
+        while pending:
+            pages = pending.popleft().result()
+            next_task = next(remaining, None)
+            if next_task is not None:
+                pending.append(executor.submit(_extract_pages, pdf_path, next_task))
+            yield from pages
+
+
+def iter_pages(pdf_path=PDF_PATH, workers=PDF_EXTRACT_WORKERS, pages_per_task=PDF_PAGES_PER_TASK, cache=None):
+    """
+    Yields (page_number, cleaned_text) for every page, in page order.
+
+    Cleaned pages are cached per (PDF hash, page number, CLEANER_VERSION). An
+    unchanged PDF is served entirely from the cache without being opened; for a
+    new or replaced PDF, pages whose content hash is already cached are reused
+    and only the rest are extracted, in parallel, streaming out in page order.
+    Cache entries are written after every pages_per_task pages, so memory does
+    not grow with the document. Hit/miss counts for the run are logged and kept
+    in iter_pages.last_stats.
+    """
+    log.debug("Attempting to open PDF: %s", pdf_path)
     if not os.path.exists(pdf_path):
-        print(f"ERROR: PDF file not found at: {pdf_path}")
-        return ""
+        log.error("PDF file not found at: %s", pdf_path)
+        return
+
+    if cache is None:
+        cache = get_page_cache()
+    pdf_hash = file_hash(pdf_path)
+    stats = {"pages": 0, "hits": 0, "misses": 0, "document_hit": False}
+    iter_pages.last_stats = stats
+
+    if cache is not None:
+        cached = cache.get_document(pdf_hash, CLEANER_VERSION)
+        if cached is not None:
+            stats.update(pages=len(cached), hits=len(cached), document_hit=True)
+            log.info("Page cache hit for whole document (%d pages), skipping extraction.", len(cached))
+            yield from cached
+            return
+
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+        page_hashes = []
+        if cache is not None:
+            digests = {}
+            for page in pdf.pages:
+                page_hashes.append(_page_hash(page, digests))
+                page.close()
+    known = cache.get_pages_by_content(page_hashes, CLEANER_VERSION) if cache is not None else {}
+    missing = [i for i in range(page_count) if cache is None or page_hashes[i] not in known]
+    stats.update(pages=page_count, hits=page_count - len(missing), misses=len(missing))
+    log.info("Page cache: %d hit(s), %d miss(es) out of %d pages.", stats['hits'], stats['misses'], page_count)
 
+    extracted = _extract_in_parallel(pdf_path, missing, workers, pages_per_task)
+    to_store = []
+    for i in range(page_count):
+        if cache is not None and page_hashes[i] in known:
+            page = (i + 1, known[page_hashes[i]])
+        else:
+            page = next(extracted)
+        if cache is not None:
+            to_store.append((page[0], page_hashes[i], page[1]))
+            if len(to_store) >= pages_per_task:
+                cache.put_pages(pdf_hash, CLEANER_VERSION, to_store)
+                to_store = []
+        yield page
+
+    if cache is not None:
+        cache.put_pages(pdf_hash, CLEANER_VERSION, to_store)
+        # Written last: the document only counts as cached once every page is
+        cache.put_document(pdf_hash, CLEANER_VERSION, page_count)
+
+
+iter_pages.last_stats = None
+
+
+def extract_text_from_pdf(pdf_path=PDF_PATH):
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                raw = page.extract_text() or ''
-                print(f"DEBUG: Page {i+1} Raw Text (first 100 chars): '{raw[:100]}...' (Length: {len(raw)})")
-                cleaned = clean_text(raw)
-                print(f"DEBUG: Page {i+1} Cleaned Text (first 100 chars): '{cleaned[:100]}...' (Length: {len(cleaned)})")
-                if cleaned:
-                    all_text.append(cleaned)
-                else:
-                    print(f"DEBUG: Page {i+1} yielded no cleaned text.")
+        all_text = [cleaned for _, cleaned in iter_pages(pdf_path) if cleaned]
         final_text = '\n'.join(all_text)
-        print(f"DEBUG: Total extracted text length: {len(final_text)}")
+        log.info("Total extracted text length: %d", len(final_text))
         return final_text
     except Exception as e:
-        print(f"ERROR: An error occurred during PDF extraction: {e}")
+        log.error("An error occurred during PDF extraction: %s", e)
         return ""
 
 if __name__ == "__main__":
@@ -50,4 +222,4 @@ if __name__ == "__main__":
     cleaned_text_path = os.path.join(os.path.dirname(__file__), 'cleaned_text.txt')
     with open(cleaned_text_path, 'w', encoding='utf-8') as f:
         f.write(text)
-    print(f"Text extracted and cleaned. Saved to {cleaned_text_path}. Total length: {len(text)}")
\ No newline at end of file
+    log.info("Text extracted and cleaned. Saved to %s. Total length: %d", cleaned_text_path, len(text))
\ No newline at end of file
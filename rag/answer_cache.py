@@ -0,0 +1,164 @@
+import os
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from rag.log import get_logger
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') == '1'
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '86400')) # Seconds
+# Minimum cosine similarity between query embeddings for a reworded question to reuse an answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.95'))
+# How often (seconds) to ask the vector store whether the corpus was re-ingested
+ANSWER_CACHE_VERSION_CHECK_INTERVAL = float(os.getenv('ANSWER_CACHE_VERSION_CHECK_INTERVAL', '5'))
+
+log = get_logger(__name__)
+
+_PUNCTUATION = re.compile(r'[?？!।॥,.;:"\'()\[\]{}\-–—]+')
+
+
+def normalize_query(query):
+    """
+    Canonical form used for exact matching: NFC, case-folded, punctuation
+    (including the Bangla danda) removed and whitespace collapsed.
+    """
+    query = unicodedata.normalize('NFC', query).casefold()
+    query = _PUNCTUATION.sub(' ', query)
+    return ' '.join(query.split())
+
+
+def context_key(retrieved_chunks):
+    """
+    Identifies the retrieved context: the chunk ids plus a hash of their texts,
+    so an answer is never served for context that has since changed.
+    """
+    digest = hashlib.sha256('\x1f'.join(c[1] for c in retrieved_chunks).encode('utf-8')).hexdigest()[:16]
+    return (tuple(c[0] for c in retrieved_chunks), digest)
+
+
+class AnswerCache:
+    """
+    In-process answer cache for /ask.
+
+    Entries are keyed by (normalized query, context_key). A lookup first tries
+    the exact key, then any entry with the same context whose query embedding
+    has cosine similarity >= threshold. Entries expire after ttl seconds, the
+    least recently used are evicted past max_entries, and everything is dropped
+    when the corpus version changes.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()  # (normalized query, context key) -> (answer, unit query embedding, created_at)
+        self._by_context = {}  # context key -> set of entry keys
+        self._lock = threading.Lock()
+        self.corpus_version = None
+        self._version_checked_at = 0.0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_context.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[key[1]]
+
+    def _expired(self, entry, now):
+        return now - entry[2] > self.ttl
+
+    def lookup(self, query, query_embedding, retrieved_chunks):
+        ctx = context_key(retrieved_chunks)
+        key = (normalize_query(query), ctx)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(key)
+
+            candidates = [k for k in self._by_context.get(ctx, ()) if not self._expired(self._entries[k], now)]
+            if candidates and query_embedding is not None:
+                unit = _unit(query_embedding)
+                sims = np.stack([self._entries[k][1] for k in candidates]) @ unit
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    match = candidates[best]
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    return self._entries[match][0]
+            self.misses += 1
+            return None
+
+    def store(self, query, query_embedding, retrieved_chunks, answer):
+        # Never cache upstream failures
+        if answer is None or answer.startswith('[Error]'):
+            return
+        ctx = context_key(retrieved_chunks)
+        key = (normalize_query(query), ctx)
+        unit = _unit(query_embedding) if query_embedding is not None else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (answer, unit, time.monotonic())
+            if unit is not None:
+                self._by_context.setdefault(ctx, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+
+    def needs_version_check(self):
+        return time.monotonic() - self._version_checked_at >= ANSWER_CACHE_VERSION_CHECK_INTERVAL
+
+    def set_corpus_version(self, version):
+        """
+        Records the current corpus version, dropping every entry if it changed.
+        """
+        self._version_checked_at = time.monotonic()
+        if version != self.corpus_version:
+            if self.corpus_version is not None:
+                self.invalidations += 1
+                log.info("Corpus version changed %s -> %s; answer cache cleared.", self.corpus_version, version)
+            self.clear()
+            self.corpus_version = version
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
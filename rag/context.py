@@ -0,0 +1,96 @@
+import os
+import re
+import unicodedata
+from collections import namedtuple
+from dotenv import load_dotenv
+from book.chunker import count_tokens
+
+load_dotenv()
+
+# Upper bound on the retrieved context placed in the prompt, in count_tokens words (not model tokens)
+CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', '1500'))
+# Shortest suffix/prefix match treated as real overlap when merging neighbouring chunks
+MIN_OVERLAP_CHARS = 20
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[\u0964\u0965?!])\s+|(?<=\.)\s+')
+
+# text: the assembled context; chunk_ids: ids that contributed, in relevance order;
+# tokens / raw_tokens: estimate after packing vs. joining the chunks verbatim
+PackedContext = namedtuple('PackedContext', ['text', 'chunk_ids', 'tokens', 'raw_tokens'])
+
+
+def _overlap(left, right):
+    """Length of the longest suffix of left that is a prefix of right (0 if below MIN_OVERLAP_CHARS)."""
+    for size in range(min(len(left), len(right)), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge_neighbours(retrieved_chunks):
+    """
+    Groups retrieved chunks with consecutive chunk_ids of the same document into blocks
+    of document text, dropping the span each chunk repeats from its predecessor. Blocks
+    keep the rank of their best chunk. Returns [(rank, chunk_ids, text)] in relevance order.
+    """
+    # chunk_id restarts in every document, so chunks are keyed and ordered by
+    # (doc_id, chunk_id); results without a doc_id fall back to (chunk_id, text)
+    ranked = {}
+    for rank, chunk in enumerate(retrieved_chunks):
+        doc_id = chunk[3] if len(chunk) > 3 else None
+        key = (doc_id or '', chunk[0], chunk[1] if doc_id is None else '')
+        ranked.setdefault(key, (rank, chunk[1]))
+    blocks = []
+    current = None
+    previous = None
+    for key in sorted(ranked):
+        doc_id, chunk_id, _ = key
+        rank, text = ranked[key]
+        if current is not None and previous[0] == doc_id and chunk_id == previous[1] + 1:
+            size = _overlap(current[2], text)
+            joined = current[2] + text[size:] if size else current[2] + '\n' + text
+            current = (min(current[0], rank), current[1] + [chunk_id], joined)
+        else:
+            if current is not None:
+                blocks.append(current)
+            current = (rank, [chunk_id], text)
+        previous = (doc_id, chunk_id)
+    if current is not None:
+        blocks.append(current)
+    return sorted(blocks, key=lambda block: block[0])
+
+
+def _sentence_key(sentence):
+    return ' '.join(unicodedata.normalize('NFC', sentence).casefold().split())
+
+
+def pack_context(retrieved_chunks, max_tokens=CONTEXT_MAX_TOKENS):
+    """
+    Assembles retrieved (chunk_id, text, distance, doc_id) tuples, best first, into prompt context:
+    neighbouring chunks are merged without their overlap, sentences already included
+    are skipped, and blocks are added in relevance order until max_tokens is reached
+    (the block that crosses the budget is cut at a sentence boundary).
+    """
+    raw_tokens = sum(count_tokens(chunk[1]) for chunk in retrieved_chunks)
+    seen = set()
+    parts, chunk_ids, tokens = [], [], 0
+    full = False
+    for _, ids, text in _merge_neighbours(retrieved_chunks):
+        kept = []
+        for sentence in _SENTENCE_SPLIT.split(text):
+            key = _sentence_key(sentence)
+            if not key or key in seen:
+                continue
+            sentence_tokens = count_tokens(sentence)
+            if tokens + sentence_tokens > max_tokens:
+                full = True
+                break
+            seen.add(key)
+            kept.append(sentence)
+            tokens += sentence_tokens
+        if kept:
+            parts.append(' '.join(kept))
+            chunk_ids.extend(ids)
+        if full:
+            break
+    return PackedContext('\n\n'.join(parts), chunk_ids, tokens, raw_tokens)
@@ -1,19 +1,68 @@
 import os
+import time
+import threading
+import numpy as np
 import psycopg2
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from rag.embedding import embed_query
+from rag.embedding_cache import text_hash
 from pgvector.psycopg2 import register_vector
+from rag.pool import ConnectionPool
+from rag.metrics import metrics, span
+from rag.log import get_logger, request_debug
 
 load_dotenv()
 
+log = get_logger(__name__)
+
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '5432') # Ensure this port matches your Docker setup (e.g., '5433')
 DB_NAME = os.getenv('DB_NAME', 'ragdb')
 DB_USER = os.getenv('DB_USER', 'postgres')
 DB_PASS = os.getenv('DB_PASS', '12345') # Ensure this password matches your Docker setup
 
-def get_connection():
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5')) # Seconds to wait for a free connection
+DB_POOL_CHECK_INTERVAL = float(os.getenv('DB_POOL_CHECK_INTERVAL', '30')) # Idle seconds before a health check
+
+# Distance metric -> (pgvector operator, operator class); the index must use the
+# operator class matching the operator in ORDER BY or the planner will ignore it
+DISTANCE_OPERATORS = {
+    'inner_product': ('<#>', 'vector_ip_ops'),
+    'cosine': ('<=>', 'vector_cosine_ops'),
+    'l2': ('<->', 'vector_l2_ops'),
+}
+DISTANCE_METRIC = os.getenv('DISTANCE_METRIC', 'inner_product')
+if DISTANCE_METRIC not in DISTANCE_OPERATORS:
+    raise ValueError(f"DISTANCE_METRIC must be one of {sorted(DISTANCE_OPERATORS)}, got '{DISTANCE_METRIC}'.")
+DISTANCE_OPERATOR, DISTANCE_OPCLASS = DISTANCE_OPERATORS[DISTANCE_METRIC]
+
+# Compact form the ANN index is built on, as (expression over the embedding column,
+# query cast template, operator, operator class). The index then only supplies
+# top_k * RERANK_FACTOR candidates, re-ranked exactly on the full vector(768) column.
+# halfvec needs pgvector >= 0.7 and is pgvector-only; the numpy backend offers 'binary'.
+QUANTIZED_INDEXES = {
+    'none': ('embedding', '{}', DISTANCE_OPERATOR, DISTANCE_OPCLASS),
+    'halfvec': ('(embedding::halfvec(768))', '{}::halfvec(768)', DISTANCE_OPERATOR, DISTANCE_OPCLASS.replace('vector_', 'halfvec_')),
+    'binary': ('(binary_quantize(embedding)::bit(768))', 'binary_quantize({})::bit(768)', '<~>', 'bit_hamming_ops'),
+}
+VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none')
+RERANK_FACTOR = int(os.getenv('RERANK_FACTOR', '4'))
+
+# ANN index over chunks.embedding: 'hnsw', 'ivfflat' or 'none' (exact scan)
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'hnsw')
+HNSW_M = int(os.getenv('HNSW_M', '16'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '64'))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '40'))
+IVFFLAT_LISTS = int(os.getenv('IVFFLAT_LISTS', '0')) # 0 picks rows / 1000 (at least 1) at build time
+IVFFLAT_PROBES = int(os.getenv('IVFFLAT_PROBES', '10'))
+
+def get_connection(register=True):
+    """
+    Opens a new, unpooled connection. Prefer get_pool().connection() on hot paths.
+    """
     conn = psycopg2.connect(
         host=DB_HOST,
         port=DB_PORT,
@@ -21,101 +70,520 @@ def get_connection():
         user=DB_USER,
         password=DB_PASS
     )
-    register_vector(conn)
+    if register:
+        register_vector(conn)
     return conn
 
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the process-wide connection pool, creating it on first use.
+    register_vector runs once per pooled connection rather than once per query.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    get_connection,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    check_interval=DB_POOL_CHECK_INTERVAL,
+                    observer=lambda seconds: metrics.observe('db_checkout', seconds),
+                )
+                metrics.register_gauges('db_pool', pool_stats)
+    return _pool
+
+def pool_stats():
+    return _pool.stats() if _pool is not None else None
+
+def async_pool_stats(pool):
+    """
+    Occupancy of an asyncpg pool, in the same terms as pool_stats.
+    """
+    if pool is None:
+        return None
+    size, idle = pool.get_size(), pool.get_idle_size()
+    return {"size": size, "idle": idle, "in_use": size - idle, "max_size": pool.get_max_size()}
+
+# The live corpus is a view named "chunks" over a versioned table chunks_v<N>.
+# Ingestion rewrites one document's changed rows in place, in one transaction,
+# so searches keep reading the previous version until commit.
+CHUNKS_VIEW = 'chunks'
+# Single-row counter bumped by every ingestion, for caches keyed on the corpus
+CORPUS_VERSION_TABLE = 'chunks_corpus'
+# Rows written before doc_id existed all came from the bundled textbook
+LEGACY_DOC_ID = 'hsc26_bangla_1st_paper'
+# Where each chunk came from: character span in the document text and 1-based page range
+CHUNK_OFFSET_COLUMNS = ('char_start', 'char_end', 'page_start', 'page_end')
+
+def _table_name(version):
+    return f"{CHUNKS_VIEW}_v{int(version)}"
+
+def _active_version(cur):
+    cur.execute(
+        """
+        SELECT max(substring(tablename from '^chunks_v([0-9]+)$')::int)
+        FROM pg_tables
+        WHERE schemaname = current_schema() AND tablename ~ '^chunks_v[0-9]+$';
+        """
+    )
+    return cur.fetchone()[0]
+
+def _quantized_index(quantization=None):
+    quantization = quantization or VECTOR_QUANTIZATION
+    if quantization not in QUANTIZED_INDEXES:
+        raise ValueError(f"VECTOR_QUANTIZATION for pgvector must be one of {sorted(QUANTIZED_INDEXES)}, got '{quantization}'.")
+    return QUANTIZED_INDEXES[quantization]
+
+def _top_k_sql(query_vector, limit, quantization=None, source=CHUNKS_VIEW, columns='chunk_id, text', rerank_factor=None):
+    """
+    SELECT of (columns..., distance) for the `limit` rows of source nearest to the SQL
+    expression query_vector. With a quantization, the inner query walks the index on
+    the compact form and the outer one re-ranks its candidates on the full vectors.
+    """
+    quantization = quantization or VECTOR_QUANTIZATION
+    exact = f"embedding {DISTANCE_OPERATOR} {query_vector}"
+    expression, cast, operator, _ = _quantized_index(quantization)
+    if quantization == 'none':
+        return f"SELECT {columns}, {exact} AS distance FROM {source} ORDER BY {exact} LIMIT {limit}"
+    return (
+        f"SELECT {columns}, {exact} AS distance FROM ("
+        f"SELECT {columns}, embedding FROM {source} "
+        f"ORDER BY {expression} {operator} {cast.format(query_vector)} LIMIT {limit} * {int(rerank_factor or RERANK_FACTOR)}"
+        f") candidates ORDER BY distance LIMIT {limit}"
+    )
+
+# Searches select doc_id too, since chunk_id is only unique within one document;
+# _result moves it behind the distance so results keep the (chunk_id, text, distance) prefix
+RESULT_COLUMNS = 'chunk_id, text, doc_id'
+
+def _result(row):
+    chunk_id, text, doc_id, distance = row
+    return (chunk_id, text, distance, doc_id)
+
+def _vector_index_sql(table, index_type, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, lists=None, quantization=None):
+    expression, _, _, opclass = _quantized_index(quantization)
+    if index_type == 'hnsw':
+        return (
+            f"CREATE INDEX {table}_embedding_idx ON {table} "
+            f"USING hnsw ({expression} {opclass}) WITH (m = {int(m)}, ef_construction = {int(ef_construction)});"
+        )
+    if index_type == 'ivfflat':
+        return (
+            f"CREATE INDEX {table}_embedding_idx ON {table} "
+            f"USING ivfflat ({expression} {opclass}) WITH (lists = {int(lists)});"
+        )
+    raise ValueError(f"Unknown vector index type '{index_type}'; expected 'hnsw' or 'ivfflat'.")
+
+def _table_indexes(cur, table):
+    """
+    Returns (name, definition) for indexes on table that do not back a constraint.
+    """
+    cur.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(ix.indexrelid)
+        FROM pg_index ix
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        JOIN pg_class t ON t.oid = ix.indrelid
+        WHERE t.relname = %s AND t.relnamespace = (SELECT oid FROM pg_namespace WHERE nspname = current_schema())
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = ix.indexrelid);
+        """,
+        (table,)
+    )
+    return cur.fetchall()
+
+def create_vector_index(index_type=VECTOR_INDEX_TYPE, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, lists=IVFFLAT_LISTS):
+    """
+    (Re)builds the ANN index on the active chunks table with the given build parameters.
+    index_type 'none' drops it so searches fall back to an exact scan. replace_document
+    then keeps the index up to date row by row.
+    """
+    try:
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('chunks_ingest'));")
+            table = _table_name(_active_version(cur))
+            for name, definition in _table_indexes(cur, table):
+                if ' USING hnsw ' in definition or ' USING ivfflat ' in definition:
+                    cur.execute(f"DROP INDEX {name};")
+            if index_type != 'none':
+                if index_type == 'ivfflat' and not lists:
+                    cur.execute(f"SELECT count(*) FROM {table};")
+                    lists = max(cur.fetchone()[0] // 1000, 1)
+                cur.execute(_vector_index_sql(table, index_type, m=m, ef_construction=ef_construction, lists=lists))
+            conn.commit()
+        log.info("Vector index on %s set to '%s' (%s).", table, index_type, _quantized_index()[3])
+    except psycopg2.Error as e:
+        log.error("Database error while building the vector index: %s", e)
+        raise e
+
+def ensure_vector_index():
+    """
+    Builds the configured ANN index if the active chunks table has none, or rebuilds it
+    when it was built for another VECTOR_QUANTIZATION.
+    """
+    if VECTOR_INDEX_TYPE == 'none':
+        return
+    opclass = _quantized_index()[3]
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        table = _table_name(_active_version(cur))
+        has_index = any(
+            (' USING hnsw ' in d or ' USING ivfflat ' in d) and f' {opclass}' in d
+            for _, d in _table_indexes(cur, table)
+        )
+    if not has_index:
+        create_vector_index()
+
+def _index_candidates(top_k):
+    # Rows the ANN index must return per query: top_k, or the re-ranking pool when quantized
+    return top_k * RERANK_FACTOR if VECTOR_QUANTIZATION != 'none' else top_k
+
+# Ranges pgvector accepts for the session settings; values outside them are an error
+HNSW_EF_SEARCH_MAX = 1000
+IVFFLAT_PROBES_MAX = 32768
+
+def _search_settings(top_k):
+    """
+    Returns the SET LOCAL statement for the index type, or None. ef_search below the
+    number of rows asked of the index would truncate the result list; both values are
+    clamped to what pgvector accepts, so a large top_k cannot fail the query.
+    """
+    if VECTOR_INDEX_TYPE == 'hnsw':
+        ef_search = min(max(HNSW_EF_SEARCH, _index_candidates(top_k), 1), HNSW_EF_SEARCH_MAX)
+        return f"SET LOCAL hnsw.ef_search = {int(ef_search)};"
+    if VECTOR_INDEX_TYPE == 'ivfflat':
+        return f"SET LOCAL ivfflat.probes = {int(min(max(IVFFLAT_PROBES, 1), IVFFLAT_PROBES_MAX))};"
+    return None
+
+def _set_search_params(cur, top_k):
+    # SET LOCAL only lasts for the current transaction, which the pool ends on return
+    settings = _search_settings(top_k)
+    if settings:
+        cur.execute(settings)
+
 def create_tables():
     conn = None
-    cur = None
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('CREATE EXTENSION IF NOT EXISTS vector;')
-        conn.commit()
-        cur.close()
-
-        # CRITICAL FIX: Add DROP TABLE IF EXISTS to ensure clean recreation
-        # And fix embedding vector size to 768 for models/embedding-001
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            DROP TABLE IF EXISTS chunks;
-            CREATE TABLE IF NOT EXISTS chunks (
-                id SERIAL PRIMARY KEY,
-                chunk_id INT,
-                text TEXT,
-                embedding vector(768) -- CORRECTED: Gemini embedding size for models/embedding-001 is 768
-            );
-        ''')
+        # The vector type must exist before register_vector can run, so this
+        # first step uses a plain connection outside the pool
+        conn = get_connection(register=False)
+        with conn.cursor() as cur:
+            cur.execute('CREATE EXTENSION IF NOT EXISTS vector;')
         conn.commit()
-        print("DEBUG: Tables created/verified successfully with vector(768).")
     except psycopg2.Error as e:
-        print(f"ERROR: Database error during table creation: {e}")
-        if conn:
-            conn.rollback()
+        log.error("Database error while enabling the vector extension: %s", e)
         raise e
     finally:
-        if cur:
-            cur.close()
         if conn:
             conn.close()
 
-def insert_chunks(chunks_with_embeddings):
-    conn = None
-    cur = None
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        execute_values(
-            cur,
-            "INSERT INTO chunks (chunk_id, text, embedding) VALUES %s",
-            chunks_with_embeddings
+        # Embedding vector size is 768 for models/embedding-001
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('chunks_ingest'));")
+            version = _active_version(cur)
+            if version is None:
+                version = 1
+                cur.execute(f'''
+                    CREATE TABLE {_table_name(version)} (
+                        doc_id TEXT NOT NULL,
+                        chunk_id INT NOT NULL,
+                        text TEXT NOT NULL,
+                        content_hash TEXT NOT NULL,
+                        embedding vector(768),
+                        char_start INT,
+                        char_end INT,
+                        page_start INT,
+                        page_end INT,
+                        PRIMARY KEY (doc_id, chunk_id)
+                    );
+                ''')
+                # Migrate a pre-versioning "chunks" base table instead of dropping it
+                cur.execute("SELECT 1 FROM pg_tables WHERE schemaname = current_schema() AND tablename = %s;", (CHUNKS_VIEW,))
+                if cur.fetchone():
+                    cur.execute(
+                        f"""
+                        INSERT INTO {_table_name(version)} (doc_id, chunk_id, text, content_hash, embedding)
+                        SELECT DISTINCT ON (chunk_id) %s, chunk_id, text, encode(sha256(convert_to(text, 'UTF8')), 'hex'), embedding
+                        FROM {CHUNKS_VIEW} ORDER BY chunk_id;
+                        """,
+                        (LEGACY_DOC_ID,)
+                    )
+                    log.info("Migrated %d legacy chunks into %s.", cur.rowcount, _table_name(version))
+                    cur.execute(f"DROP TABLE {CHUNKS_VIEW};")
+            # Source offsets were added with sentence-aware chunking; older tables get NULLs
+            # until their document is re-ingested
+            for column in CHUNK_OFFSET_COLUMNS:
+                cur.execute(f"ALTER TABLE {_table_name(version)} ADD COLUMN IF NOT EXISTS {column} INT;")
+            cur.execute(f"CREATE OR REPLACE VIEW {CHUNKS_VIEW} AS SELECT * FROM {_table_name(version)};")
+            # Starts at the table version so the counter keeps growing on existing databases
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {CORPUS_VERSION_TABLE} (version INT NOT NULL);")
+            cur.execute(
+                f"INSERT INTO {CORPUS_VERSION_TABLE} (version) SELECT %s WHERE NOT EXISTS (SELECT 1 FROM {CORPUS_VERSION_TABLE});",
+                (version,)
+            )
+            conn.commit()
+        log.info("Tables created/verified successfully (%s with vector(768)).", _table_name(version))
+    except psycopg2.Error as e:
+        # The pool rolls back the connection when it is returned
+        log.error("Database error during table creation: %s", e)
+        raise e
+
+def get_corpus_version():
+    """
+    Returns the corpus version, which changes whenever a document is replaced.
+    """
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s);", (CORPUS_VERSION_TABLE,))
+        if cur.fetchone()[0] is None:
+            # Database not yet upgraded by create_tables()
+            return _active_version(cur)
+        cur.execute(f"SELECT version FROM {CORPUS_VERSION_TABLE};")
+        return cur.fetchone()[0]
+
+def get_document_chunks(doc_id):
+    """
+    Returns {content_hash: (chunk_id, embedding)} for the stored chunks of one document,
+    so ingestion can reuse embeddings of chunks whose text has not changed.
+    """
+    try:
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"SELECT content_hash, chunk_id, embedding FROM {CHUNKS_VIEW} WHERE doc_id = %s;",
+                (doc_id,)
+            )
+            return {content_hash: (chunk_id, embedding) for content_hash, chunk_id, embedding in cur.fetchall()}
+    except psycopg2.Error as e:
+        log.error("Database error while reading document chunks: %s", e)
+        raise e
+
+def replace_document(doc_id, chunks_with_embeddings):
+    """
+    Atomically replaces every chunk of doc_id with the given (chunk_id, text, embedding)
+    or (chunk_id, text, embedding, (char_start, char_end, page_start, page_end)) tuples.
+    Only rows whose chunk_id or text changed are deleted and re-inserted, and moved
+    offsets are updated in place, all in one transaction: readers see the old or the
+    new document, never a mix, and the ANN index is only updated for the changed rows.
+    Other documents are not touched. Returns the new corpus version.
+    """
+    rows = [
+        (doc_id, row[0], row[1], text_hash(row[1]), row[2], *(row[3] if len(row) > 3 else (None,) * 4))
+        for row in chunks_with_embeddings
+    ]
+    try:
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            # Serialize concurrent ingestions; readers are not blocked by this lock
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('chunks_ingest'));")
+            version = _active_version(cur)
+            if version is None:
+                raise RuntimeError("chunks table does not exist; call create_tables() first.")
+            table = _table_name(version)
+            cur.execute(f"SELECT chunk_id, content_hash FROM {table} WHERE doc_id = %s;", (doc_id,))
+            stored = dict(cur.fetchall())
+            changed = [row for row in rows if stored.get(row[1]) != row[3]]
+            kept = [row for row in rows if stored.get(row[1]) == row[3]]
+            new_ids = {row[1] for row in rows}
+            removed = [chunk_id for chunk_id in stored if chunk_id not in new_ids]
+            stale = removed + [row[1] for row in changed if row[1] in stored]
+            if stale:
+                cur.execute(f"DELETE FROM {table} WHERE doc_id = %s AND chunk_id = ANY(%s);", (doc_id, stale))
+            if changed:
+                execute_values(
+                    cur,
+                    f"INSERT INTO {table} (doc_id, chunk_id, text, content_hash, embedding, {', '.join(CHUNK_OFFSET_COLUMNS)}) VALUES %s",
+                    changed
+                )
+            if kept:
+                # Text before an unchanged chunk may have grown or shrunk, shifting its offsets
+                columns = ', '.join(CHUNK_OFFSET_COLUMNS)
+                execute_values(
+                    cur,
+                    f"UPDATE {table} AS t SET ({columns}) = ({', '.join('v.' + c for c in CHUNK_OFFSET_COLUMNS)}) "
+                    f"FROM (VALUES %s) AS v(doc_id, chunk_id, {columns}) "
+                    f"WHERE t.doc_id = v.doc_id AND t.chunk_id = v.chunk_id "
+                    f"AND ({', '.join('t.' + c for c in CHUNK_OFFSET_COLUMNS)}) IS DISTINCT FROM ({', '.join('v.' + c for c in CHUNK_OFFSET_COLUMNS)})",
+                    [(row[0], row[1], *row[5:]) for row in kept],
+                    template="(%s, %s, %s::int, %s::int, %s::int, %s::int)"
+                )
+            cur.execute(f"UPDATE {CORPUS_VERSION_TABLE} SET version = version + 1 RETURNING version;")
+            corpus_version = cur.fetchone()[0]
+            conn.commit()
+        log.info(
+            "Replaced document '%s' in %s: %d chunks written, %d removed, %d kept.",
+            doc_id, table, len(changed), len(removed), len(kept)
         )
-        conn.commit()
-        print(f"DEBUG: Inserted {len(chunks_with_embeddings)} chunks into DB.")
+        return corpus_version
     except psycopg2.Error as e:
-        print(f"ERROR: Database error during chunk insertion: {e}")
-        if conn:
-            conn.rollback()
+        log.error("Database error during document replacement: %s", e)
+        raise e
+
+def insert_chunks(chunks_with_embeddings, doc_id=LEGACY_DOC_ID):
+    """
+    Stores (chunk_id, text, embedding) tuples as the full chunk set of doc_id.
+    """
+    replace_document(doc_id, chunks_with_embeddings)
+    log.info("Inserted %d chunks into DB.", len(chunks_with_embeddings))
+
+def search_by_embedding(query_embedding, top_k=4):
+    """
+    Returns the top_k (chunk_id, text, distance, doc_id) rows closest to query_embedding.
+    """
+    try:
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            _set_search_params(cur, top_k)
+            cur.execute(
+                _top_k_sql('%(query)s::vector', '%(top_k)s', columns=RESULT_COLUMNS) + ';',
+                {'query': query_embedding, 'top_k': top_k}
+            )
+            results = [_result(row) for row in cur.fetchall()]
+        request_debug(log, "Found %d similar chunks for query.", len(results))
+        return results
+    except psycopg2.Error as e:
+        log.error("Database error during similarity search: %s", e)
+        raise e
+
+def _vector_literal(vector):
+    # pgvector's text input format; .9g round-trips float32 exactly
+    return '[' + ','.join(f'{x:.9g}' for x in np.asarray(vector, dtype=np.float32)) + ']'
+
+def _batch_search_sql(vectors, limit):
+    # One LATERAL top-k per query row, so N queries cost a single round trip
+    return f"""
+        SELECT q.idx, c.chunk_id, c.text, c.doc_id, c.distance
+        FROM unnest({vectors}::text[]) WITH ORDINALITY AS q(qv, idx)
+        CROSS JOIN LATERAL ({_top_k_sql('q.qv::vector', limit, columns=RESULT_COLUMNS)}) c
+        ORDER BY q.idx, c.distance;
+    """
+
+def _group_batch_rows(rows, count):
+    results = [[] for _ in range(count)]
+    for idx, *row in rows:
+        results[idx - 1].append(_result(row))
+    return results
+
+def search_by_embeddings(query_embeddings, top_k=4):
+    """
+    Top-k search for many query embeddings in one multi-row query.
+    Returns one list of (chunk_id, text, distance, doc_id) per query, in input order.
+    """
+    if not query_embeddings:
+        return []
+    try:
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            _set_search_params(cur, top_k)
+            # Named parameters: with a quantization the limit appears twice in the SQL
+            cur.execute(
+                _batch_search_sql('%(vectors)s', '%(top_k)s'),
+                {'vectors': [_vector_literal(q) for q in query_embeddings], 'top_k': top_k}
+            )
+            rows = cur.fetchall()
+        return _group_batch_rows(rows, len(query_embeddings))
+    except psycopg2.Error as e:
+        log.error("Database error during batch similarity search: %s", e)
+        raise e
+
+async def create_async_pool():
+    """
+    Creates an asyncpg pool for the async request path. Create it once (in the
+    FastAPI lifespan) and close it on shutdown.
+    """
+    import asyncpg
+    from pgvector.asyncpg import register_vector as register_vector_async
+    return await asyncpg.create_pool(
+        host=DB_HOST,
+        port=int(DB_PORT),
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        init=register_vector_async,
+    )
+
+async def asearch_by_embedding(pool, query_embedding, top_k=4):
+    """
+    Async search_by_embedding on an asyncpg pool.
+    """
+    import asyncpg
+    try:
+        started = time.perf_counter()
+        async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn, conn.transaction():
+            metrics.observe('db_checkout', time.perf_counter() - started)
+            settings = _search_settings(top_k)
+            if settings:
+                await conn.execute(settings)
+            rows = await conn.fetch(
+                _top_k_sql('$1::vector', '$2', columns=RESULT_COLUMNS) + ';',
+                np.asarray(query_embedding, dtype=np.float32), top_k
+            )
+        request_debug(log, "Found %d similar chunks for query.", len(rows))
+        return [_result(row) for row in rows]
+    except asyncpg.PostgresError as e:
+        log.error("Database error during similarity search: %s", e)
+        raise e
+
+async def asearch_by_embeddings(pool, query_embeddings, top_k=4):
+    """
+    Async search_by_embeddings on an asyncpg pool.
+    """
+    import asyncpg
+    if not query_embeddings:
+        return []
+    try:
+        started = time.perf_counter()
+        async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn, conn.transaction():
+            metrics.observe('db_checkout', time.perf_counter() - started)
+            settings = _search_settings(top_k)
+            if settings:
+                await conn.execute(settings)
+            rows = await conn.fetch(
+                _batch_search_sql('$1', '$2'),
+                [_vector_literal(q) for q in query_embeddings], top_k
+            )
+        return _group_batch_rows(rows, len(query_embeddings))
+    except asyncpg.PostgresError as e:
+        log.error("Database error during batch similarity search: %s", e)
         raise e
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
 def search_similar_chunks(query_text, top_k=4):
     try:
         # Unpack the tuple to get only the embedding vector from embed_query
         _, _, query_embedding_vector = embed_query(query_text)
     except Exception as e:
-        print(f"ERROR: Failed to embed query in search_similar_chunks: {e}")
+        log.error("Failed to embed query in search_similar_chunks: %s", e)
         raise
 
-    conn = None
-    cur = None
+    with span('vector_search'):
+        return search_by_embedding(query_embedding_vector, top_k=top_k)
+
+def fetch_all_chunks():
+    """
+    Returns every stored (doc_id, chunk_id, text, embedding, char_start, char_end, page_start,
+    page_end) row, ordered by document and chunk.
+    """
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT chunk_id, text, embedding <#> %s::vector AS distance
-            FROM chunks
-            ORDER BY embedding <#> %s::vector
-            LIMIT %s;
-            """,
-            (query_embedding_vector, query_embedding_vector, top_k)
-        )
-        results = cur.fetchall()
-        print(f"DEBUG: Found {len(results)} similar chunks for query.")
-        return results
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"SELECT doc_id, chunk_id, text, embedding, {', '.join(CHUNK_OFFSET_COLUMNS)} "
+                f"FROM {CHUNKS_VIEW} ORDER BY doc_id, chunk_id;"
+            )
+            return cur.fetchall()
     except psycopg2.Error as e:
-        print(f"ERROR: Database error during similarity search: {e}")
-        if conn:
-            conn.rollback()
+        log.error("Database error while reading chunks: %s", e)
+        raise e
+
+def fetch_chunk_texts():
+    """
+    Returns every stored (doc_id, chunk_id, text) row without embeddings, for building
+    the in-process lexical index.
+    """
+    try:
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT doc_id, chunk_id, text FROM {CHUNKS_VIEW} ORDER BY doc_id, chunk_id;")
+            return cur.fetchall()
+    except psycopg2.Error as e:
+        log.error("Database error while reading chunk texts: %s", e)
         raise e
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
\ No newline at end of file
@@ -1,74 +1,326 @@
 import os
-import requests # Using requests for direct API calls as per your setup
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from rag.embedding_cache import get_cache
+from rag.metrics import span, count_call, count_retry
+from rag.log import get_logger, request_debug
 
 load_dotenv()
 
+log = get_logger(__name__)
+
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+EMBEDDING_MODEL = 'models/embedding-001'
+# Base URL is configurable so ingestion can be pointed at a local stub server
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')
 # Use the correct embedding endpoint URL
-GEMINI_EMBEDDING_URL = 'https://generativelanguage.googleapis.com/v1beta/models/embedding-001:embedContent'
+GEMINI_EMBEDDING_URL = f'{GEMINI_API_BASE}/{EMBEDDING_MODEL}:embedContent'
+GEMINI_BATCH_EMBEDDING_URL = f'{GEMINI_API_BASE}/{EMBEDDING_MODEL}:batchEmbedContents'
 
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables.")
+# batchEmbedContents accepts at most 100 requests per call
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '100'))
+EMBED_MAX_CONCURRENCY = int(os.getenv('EMBED_MAX_CONCURRENCY', '4'))
+EMBED_MAX_RETRIES = int(os.getenv('EMBED_MAX_RETRIES', '5'))
+EMBED_BACKOFF_BASE = float(os.getenv('EMBED_BACKOFF_BASE', '0.5'))
+EMBED_BACKOFF_MAX = float(os.getenv('EMBED_BACKOFF_MAX', '30'))
+EMBED_TIMEOUT = float(os.getenv('EMBED_TIMEOUT', '60'))
 
-def get_embedding(text: str, task_type: str):
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
     """
-    Generates an embedding for the given text using the Gemini embedding model
-    via direct REST API call.
-    Requires a task_type ("retrieval_document" or "retrieval_query").
+    Returns the process-wide requests.Session, creating it on first use.
+    The connection pool is sized to the embedding concurrency so parallel
+    batches reuse keep-alive connections instead of reconnecting.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Using requests for direct API calls; imported on first use to keep `import rag` cheap
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(EMBED_MAX_CONCURRENCY, 1))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({"Content-Type": "application/json"})
+                _session = session
+    return _session
+
+def _api_key():
+    # Checked per call rather than at import, so importing rag needs no credentials
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    return GEMINI_API_KEY
+
+def _post_with_retries(url, data):
+    """
+    POSTs to the Gemini API, retrying 429 and 5xx responses (and connection
+    errors) with exponential backoff. Honors a Retry-After header if present.
     """
+    import requests
+    params = {"key": _api_key()}
+    session = get_session()
+    attempt = 0
+    while True:
+        response = None
+        try:
+            response = session.post(url, params=params, json=data, timeout=EMBED_TIMEOUT)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+                count_call('gemini_embedding', 'ok')
+                return response.json()
+            error = requests.exceptions.HTTPError(f"{response.status_code} from Embedding API", response=response)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        except requests.exceptions.RequestException as e:
+            count_call('gemini_embedding', 'error')
+            raise Exception(f"Gemini Embedding API request failed: {e}. Response text: {response.text if response is not None else 'No response content'}")
+
+        attempt += 1
+        if attempt > EMBED_MAX_RETRIES:
+            count_call('gemini_embedding', 'error')
+            raise Exception(f"Gemini Embedding API request failed after {EMBED_MAX_RETRIES} retries: {error}. Response text: {response.text if response is not None else 'No response content'}")
+        delay = _retry_delay(attempt, response)
+        count_retry('gemini_embedding')
+        log.warning("Embedding API call failed (%s), retry %d/%d in %.1fs.", error, attempt, EMBED_MAX_RETRIES, delay)
+        time.sleep(delay)
+
+async def _apost_with_retries(client, url, data):
+    """
+    Async counterpart of _post_with_retries on a shared httpx.AsyncClient.
+    """
+    import httpx
+    params = {"key": _api_key()}
+    attempt = 0
+    while True:
+        response = None
+        try:
+            response = await client.post(url, params=params, json=data)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                response.raise_for_status() # Raise an HTTPStatusError for bad responses (4xx or 5xx)
+                count_call('gemini_embedding', 'ok')
+                return response.json()
+            error = f"{response.status_code} from Embedding API"
+        except httpx.TransportError as e:
+            error = e
+        except httpx.HTTPError as e:
+            count_call('gemini_embedding', 'error')
+            raise Exception(f"Gemini Embedding API request failed: {e}. Response text: {response.text if response is not None else 'No response content'}")
+
+        attempt += 1
+        if attempt > EMBED_MAX_RETRIES:
+            count_call('gemini_embedding', 'error')
+            raise Exception(f"Gemini Embedding API request failed after {EMBED_MAX_RETRIES} retries: {error}. Response text: {response.text if response is not None else 'No response content'}")
+        delay = _retry_delay(attempt, response)
+        count_retry('gemini_embedding')
+        log.warning("Embedding API call failed (%s), retry %d/%d in %.1fs.", error, attempt, EMBED_MAX_RETRIES, delay)
+        await asyncio.sleep(delay)
+
+def _retry_delay(attempt, response):
+    delay = min(EMBED_BACKOFF_BASE * (2 ** (attempt - 1)), EMBED_BACKOFF_MAX)
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+def create_async_client():
+    """
+    Creates the httpx.AsyncClient used by the async request path. Create it once
+    (in the FastAPI lifespan) and close it on shutdown.
+    """
+    import httpx
+    return httpx.AsyncClient(
+        headers={"Content-Type": "application/json"},
+        timeout=EMBED_TIMEOUT,
+        limits=httpx.Limits(max_connections=max(EMBED_MAX_CONCURRENCY, 1), max_keepalive_connections=max(EMBED_MAX_CONCURRENCY, 1)),
+    )
+
+def _validate_text(text):
     if not isinstance(text, str):
         raise TypeError(f"Expected text input to be a string, got {type(text)}")
     if not text.strip():
         # Returning an empty list or raising an error for empty text might be better depending on downstream
         raise ValueError("Cannot get embedding for empty or whitespace-only text.")
 
-    headers = {"Content-Type": "application/json"}
-    params = {"key": GEMINI_API_KEY}
-    data = {
-        "model": "models/embedding-001",
+def _embed_request(text, task_type):
+    return {
+        "model": EMBEDDING_MODEL,
         "content": {"parts": [{"text": text}]},
         "task_type": task_type, # CRITICAL FIX: Add the required task_type
         # "title": "Document chunk" if task_type == "retrieval_document" else "Query" # Optional, can be added for context
     }
 
+def _parse_embedding(json_response):
+    # Check if the 'embedding' key exists in the response
+    if 'embedding' in json_response and 'values' in json_response['embedding']:
+        return json_response['embedding']['values']
+    raise ValueError(
+        f"Unexpected response structure from Embedding API. "
+        f"'embedding' or 'values' key missing. Full response: {json_response}"
+    )
+
+def get_embedding(text: str, task_type: str):
+    """
+    Generates an embedding for the given text using the Gemini embedding model
+    via direct REST API call.
+    Requires a task_type ("retrieval_document" or "retrieval_query").
+    """
+    _validate_text(text)
+
+    cache = get_cache()
+    if cache is not None:
+        cached = cache.get(EMBEDDING_MODEL, task_type, text)
+        if cached is not None:
+            return cached
+
     try:
-        response = requests.post(GEMINI_EMBEDDING_URL, headers=headers, params=params, json=data)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+        with span('embedding'):
+            values = _parse_embedding(_post_with_retries(GEMINI_EMBEDDING_URL, _embed_request(text, task_type)))
+    except Exception as e:
+        raise Exception(f"Gemini Embedding API error: {str(e)}")
+    if cache is not None:
+        cache.put(EMBEDDING_MODEL, task_type, text, values)
+    return values
 
-        json_response = response.json()
+async def aget_embedding(client, text: str, task_type: str, limiter=None):
+    """
+    Async get_embedding over a shared httpx.AsyncClient. limiter is an optional
+    asyncio.Semaphore bounding concurrent calls to the embedding API.
+    """
+    _validate_text(text)
 
-        # Check if the 'embedding' key exists in the response
-        if 'embedding' in json_response and 'values' in json_response['embedding']:
-            return json_response['embedding']['values']
-        else:
-            raise ValueError(
-                f"Unexpected response structure from Embedding API. "
-                f"'embedding' or 'values' key missing. Full response: {json_response}"
-            )
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Gemini Embedding API request failed: {e}. Response text: {response.text if 'response' in locals() else 'No response content'}")
+    cache = get_cache()
+    if cache is not None:
+        # The SQLite cache is shared with other workers and ingestion, and can wait on their
+        # write lock; it runs in a thread so the event loop is never blocked on it
+        cached = await asyncio.to_thread(cache.get, EMBEDDING_MODEL, task_type, text)
+        if cached is not None:
+            return cached
+
+    try:
+        # Includes time queued on the limiter, which is part of what the caller waits for
+        with span('embedding'):
+            if limiter is not None:
+                async with limiter:
+                    json_response = await _apost_with_retries(client, GEMINI_EMBEDDING_URL, _embed_request(text, task_type))
+            else:
+                json_response = await _apost_with_retries(client, GEMINI_EMBEDDING_URL, _embed_request(text, task_type))
+        values = _parse_embedding(json_response)
     except Exception as e:
         raise Exception(f"Gemini Embedding API error: {str(e)}")
+    if cache is not None:
+        await asyncio.to_thread(cache.put, EMBEDDING_MODEL, task_type, text, values)
+    return values
+
+def _parse_batch_embeddings(json_response, expected):
+    embeddings = json_response.get('embeddings')
+    if embeddings is None or len(embeddings) != expected:
+        raise ValueError(
+            f"Unexpected response structure from Batch Embedding API. "
+            f"Expected {expected} embeddings, got {len(embeddings) if embeddings is not None else 'none'}."
+        )
+    try:
+        return [e['values'] for e in embeddings]
+    except (KeyError, TypeError):
+        raise ValueError(f"Unexpected response structure from Batch Embedding API. 'values' key missing.")
+
+def get_embeddings_batch(texts, task_type: str):
+    """
+    Generates embeddings for a list of texts with a single batchEmbedContents
+    call. Returns the vectors in the same order as the input texts.
+    """
+    for text in texts:
+        _validate_text(text)
+
+    data = {"requests": [_embed_request(text, task_type) for text in texts]}
+    with span('embedding_batch'):
+        return _parse_batch_embeddings(_post_with_retries(GEMINI_BATCH_EMBEDDING_URL, data), len(texts))
 
-def embed_chunks(chunks):
+async def aget_embeddings_batch(client, texts, task_type: str, limiter=None):
+    """
+    Async get_embeddings_batch over a shared httpx.AsyncClient.
+    """
+    for text in texts:
+        _validate_text(text)
+
+    data = {"requests": [_embed_request(text, task_type) for text in texts]}
+    with span('embedding_batch'):
+        if limiter is not None:
+            async with limiter:
+                json_response = await _apost_with_retries(client, GEMINI_BATCH_EMBEDDING_URL, data)
+        else:
+            json_response = await _apost_with_retries(client, GEMINI_BATCH_EMBEDDING_URL, data)
+    return _parse_batch_embeddings(json_response, len(texts))
+
+def embed_chunks(chunks, batch_size=EMBED_BATCH_SIZE, max_concurrency=EMBED_MAX_CONCURRENCY, use_cache=True):
     """
     Generates embeddings for a list of text chunks using 'retrieval_document' task_type.
+    Chunks already in the embedding cache are served from it; the rest are sent in
+    batchEmbedContents requests of up to batch_size texts, with at most max_concurrency
+    requests in flight. Returns (chunk_id, text, embedding) tuples in chunk order;
+    chunks whose batch fails after all retries are skipped. use_cache=False neither
+    reads nor writes the cache, for one-off texts that should not evict stored chunks.
     """
-    embedded = []
-    print(f"DEBUG: Starting embedding of {len(chunks)} chunks.")
+    log.info("Starting embedding of %d chunks (batch_size=%d, concurrency=%d).", len(chunks), batch_size, max_concurrency)
+    started = time.perf_counter()
+
+    valid = []
     for i, chunk in enumerate(chunks):
-        if i % 10 == 0:
-            print(f"DEBUG: Embedding chunk {i+1}/{len(chunks)}...")
-        try:
-            # Pass task_type="retrieval_document" for document chunks
-            emb = get_embedding(chunk, task_type="retrieval_document")
-            if emb is not None:
-                embedded.append((i, chunk, emb))
-        except Exception as e:
-            print(f"WARNING: Skipping chunk {i} due to embedding error: {e}")
+        if not isinstance(chunk, str) or not chunk.strip():
+            log.warning("Skipping chunk %s due to embedding error: empty or non-string chunk.", i)
             continue
-    print(f"DEBUG: Finished embedding chunks. Successfully embedded {len(embedded)} chunks.")
+        valid.append((i, chunk))
+
+    cache = get_cache() if use_cache else None
+    cached = {}
+    if cache is not None and valid:
+        vectors = cache.get_many(EMBEDDING_MODEL, "retrieval_document", [chunk for _, chunk in valid])
+        cached = {i: (i, chunk, emb) for (i, chunk), emb in zip(valid, vectors) if emb is not None}
+        log.info("%d/%d chunks served from the embedding cache.", len(cached), len(valid))
+
+    batches = []
+    for i, chunk in valid:
+        if i in cached:
+            continue
+        if not batches or len(batches[-1]) >= batch_size:
+            batches.append([])
+        batches[-1].append((i, chunk))
+
+    def embed_batch(batch):
+        vectors = get_embeddings_batch([chunk for _, chunk in batch], task_type="retrieval_document")
+        if cache is not None:
+            cache.put_many(EMBEDDING_MODEL, "retrieval_document", [(chunk, emb) for (_, chunk), emb in zip(batch, vectors)])
+        return [(i, chunk, emb) for (i, chunk), emb in zip(batch, vectors)]
+
+    embedded = list(cached.values())
+    with ThreadPoolExecutor(max_workers=max(max_concurrency, 1)) as executor:
+        futures = [executor.submit(embed_batch, batch) for batch in batches]
+        for n, (batch, future) in enumerate(zip(batches, futures), 1):
+            try:
+                embedded.extend(future.result())
+            except Exception as e:
+                log.warning("Skipping chunks %s-%s due to embedding error: %s", batch[0][0], batch[-1][0], e)
+                continue
+            log.debug("Embedded batch %d/%d.", n, len(batches))
+
+    # Cached and freshly embedded chunks are interleaved; restore chunk order
+    embedded.sort(key=lambda item: item[0])
+    elapsed = time.perf_counter() - started
+    rate = len(embedded) / elapsed if elapsed > 0 else 0.0
+    log.info("Finished embedding chunks. Successfully embedded %d chunks in %.2fs (%.1f chunks/s).", len(embedded), elapsed, rate)
+    if cache is not None:
+        log.info("Embedding cache stats: %s", cache.stats())
     return embedded
 
 def embed_query(query_text):
@@ -76,10 +328,61 @@ def embed_query(query_text):
     Embeds a single query text using 'retrieval_query' task_type.
     Returns a tuple (0, query_text, embedding_vector) to match db.py's expectation.
     """
-    print(f"DEBUG: Embedding query text (first 50 chars): '{query_text[:50]}...'")
+    request_debug(log, "Embedding query text (first 50 chars): '%s...'", query_text[:50])
     # Pass task_type="retrieval_query" for the query text
     query_emb = get_embedding(query_text, task_type="retrieval_query")
     if query_emb is None:
         raise Exception("Failed to embed query text, embedding was None.")
-    print(f"DEBUG: Query embedding length: {len(query_emb)}")
-    return (0, query_text, query_emb)
\ No newline at end of file
+    request_debug(log, "Query embedding length: %d", len(query_emb))
+    return (0, query_text, query_emb)
+
+async def aembed_query(client, query_text, limiter=None):
+    """
+    Async embed_query; returns (0, query_text, embedding_vector).
+    """
+    request_debug(log, "Embedding query text (first 50 chars): '%s...'", query_text[:50])
+    query_emb = await aget_embedding(client, query_text, task_type="retrieval_query", limiter=limiter)
+    if query_emb is None:
+        raise Exception("Failed to embed query text, embedding was None.")
+    return (0, query_text, query_emb)
+
+def embed_queries(query_texts, batch_size=EMBED_BATCH_SIZE):
+    """
+    Embeds many queries with 'retrieval_query' task_type: cached vectors are reused
+    and the rest go out in batchEmbedContents calls. Returns vectors in input order.
+    """
+    cache = get_cache()
+    vectors = cache.get_many(EMBEDDING_MODEL, "retrieval_query", query_texts) if cache is not None else [None] * len(query_texts)
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    for start in range(0, len(missing), batch_size):
+        part = missing[start:start + batch_size]
+        fresh = get_embeddings_batch([query_texts[i] for i in part], task_type="retrieval_query")
+        for i, emb in zip(part, fresh):
+            vectors[i] = emb
+        if cache is not None:
+            cache.put_many(EMBEDDING_MODEL, "retrieval_query", [(query_texts[i], emb) for i, emb in zip(part, fresh)])
+    request_debug(log, "Embedded %d queries (%d via the API).", len(query_texts), len(missing))
+    return vectors
+
+async def aembed_queries(client, query_texts, batch_size=EMBED_BATCH_SIZE, limiter=None):
+    """
+    Async embed_queries; batches are sent concurrently, bounded by limiter. Cache
+    reads and writes run in a thread, as in aget_embedding.
+    """
+    cache = get_cache()
+    vectors = [None] * len(query_texts)
+    if cache is not None:
+        vectors = await asyncio.to_thread(cache.get_many, EMBEDDING_MODEL, "retrieval_query", query_texts)
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    parts = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    results = await asyncio.gather(*[
+        aget_embeddings_batch(client, [query_texts[i] for i in part], task_type="retrieval_query", limiter=limiter)
+        for part in parts
+    ])
+    for part, fresh in zip(parts, results):
+        for i, emb in zip(part, fresh):
+            vectors[i] = emb
+        if cache is not None:
+            await asyncio.to_thread(cache.put_many, EMBEDDING_MODEL, "retrieval_query", [(query_texts[i], emb) for i, emb in zip(part, fresh)])
+    request_debug(log, "Embedded %d queries (%d via the API).", len(query_texts), len(missing))
+    return vectors
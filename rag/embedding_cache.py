@@ -0,0 +1,151 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', '1') == '1'
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(DATA_DIR, 'embedding_cache.sqlite3'))
+# 768 float32 values are ~3 KB, so the default bound is roughly 150 MB on disk
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '50000'))
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _to_blob(vector):
+    return array('f', vector).tobytes()
+
+
+def _from_blob(blob):
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache keyed by (model, task_type, sha256(text)).
+    Vectors are stored as float32 blobs in SQLite; the least recently used
+    entries are evicted once the cache grows past max_entries.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # WAL lets several uvicorn workers read while one writes
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL;')
+        self._conn.execute('PRAGMA synchronous=NORMAL;')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, task_type, text_hash)
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);')
+        self._conn.commit()
+
+    def get(self, model, task_type, text):
+        return self.get_many(model, task_type, [text])[0]
+
+    def get_many(self, model, task_type, texts):
+        """
+        Returns a list aligned with texts holding the cached vector, or None on a miss.
+        """
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND task_type = ? "
+                    f"AND text_hash IN ({','.join('?' * len(part))})",
+                    [model, task_type, *part]
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND task_type = ? AND text_hash = ?",
+                    [(now, model, task_type, h) for h in found]
+                )
+                self._conn.commit()
+            results = [_from_blob(found[h]) if h in found else None for h in hashes]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put(self, model, task_type, text, vector):
+        self.put_many(model, task_type, [(text, vector)])
+
+    def put_many(self, model, task_type, items):
+        """
+        Stores (text, vector) pairs and evicts least recently used entries past max_entries.
+        """
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, task_type, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(model, task_type, text_hash(text), _to_blob(vector), now) for text, vector in items]
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+                self.evictions += excess
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the shared EmbeddingCache, or None when caching is disabled.
+    """
+    global _cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
@@ -1,16 +1,246 @@
-from sklearn.metrics.pairwise import cosine_similarity
+# Evaluation over a Q&A file: batched retrieval, then recall@k, MRR, groundedness and
+# answer match computed with NumPy over whole (questions x top_k) matrices. Chunk
+# vectors are read from the vector store, never re-embedded.
+#
+#   python -m rag.evaluation --qa bench/sample_qa.json --top-k 4 --output eval.json
+#   python -m rag.evaluation --qa questions.json --generate --details
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from rag.answer_cache import normalize_query
+from rag.log import get_logger
+
+log = get_logger(__name__)
 
 # For automatic evaluation
 
+def normalize_rows(matrix):
+    # Zero rows stay zero instead of turning into NaNs
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
 def evaluate_groundedness(answer_embedding, context_embeddings):
     # Returns the max cosine similarity between answer and any context chunk
-    sims = cosine_similarity([answer_embedding], context_embeddings)
+    sims = normalize_rows(context_embeddings) @ normalize_rows(answer_embedding)
     return float(np.max(sims))
 
+def groundedness_scores(answer_embeddings, context_embeddings, context_mask):
+    """
+    Vectorized evaluate_groundedness for a whole dataset: answer_embeddings is
+    (questions, dim), context_embeddings (questions, top_k, dim) and context_mask
+    (questions, top_k) marks the real chunks. Returns the max cosine per question,
+    NaN where a question has no context.
+    """
+    sims = np.einsum('qd,qkd->qk', normalize_rows(answer_embeddings), normalize_rows(context_embeddings))
+    sims = np.where(context_mask, sims, -np.inf)
+    best = sims.max(axis=1, initial=-np.inf)
+    return np.where(np.isfinite(best), best, np.nan)
+
+def rank_metrics(relevant):
+    """
+    relevant is a (questions, top_k) boolean matrix in rank order. Returns recall@k
+    (share of questions with a relevant chunk in the top k), precision@k, MRR and
+    the 0-based rank of each question's first relevant chunk (-1 for a miss).
+    """
+    relevant = np.asarray(relevant, dtype=bool)
+    if not relevant.size:
+        return {'recall': 0.0, 'precision': 0.0, 'mrr': 0.0, 'first_ranks': np.full(len(relevant), -1)}
+    hit = relevant.any(axis=1)
+    first = np.where(hit, relevant.argmax(axis=1), -1)
+    reciprocal = np.where(hit, 1.0 / (np.maximum(first, 0) + 1), 0.0)
+    return {
+        'recall': float(hit.mean()),
+        'precision': float(relevant.mean()),
+        'mrr': float(reciprocal.mean()),
+        'first_ranks': first,
+    }
+
+def answer_match(answers, expected):
+    """
+    1.0 where the normalized expected answer appears in the normalized answer.
+    """
+    return np.array([
+        bool(e) and e in a
+        for a, e in zip(map(normalize_query, answers), map(normalize_query, expected))
+    ], dtype=np.float32)
+
 # For human-labeled evaluation, compare system answer to expected answer
 
 def evaluate_relevance(retrieved_chunks, expected_chunks):
     retrieved_ids = set([c[0] for c in retrieved_chunks])
     expected_ids = set(expected_chunks)
-    return len(retrieved_ids & expected_ids) / max(1, len(expected_ids)) 
\ No newline at end of file
+    return len(retrieved_ids & expected_ids) / max(1, len(expected_ids))
+
+def load_qa(path):
+    """
+    Reads a JSON list (or JSON-lines file) of {"question", "answer", optional
+    "evidence": [substrings of a relevant chunk], optional "chunk_ids": [...]}
+    objects, or of [question, answer] pairs as in test_api.py.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)
+    return [
+        item if isinstance(item, dict) else {'question': item[0], 'answer': item[1]}
+        for item in items
+    ]
+
+def relevance_matrix(qa, retrieved, top_k):
+    """
+    (questions, top_k) booleans: a retrieved chunk is relevant if its id is in the
+    item's chunk_ids, or its text contains the expected answer or an evidence string.
+    """
+    relevant = np.zeros((len(qa), top_k), dtype=bool)
+    # The same few chunks come back for many questions; normalize each text once
+    normalized = {}
+    for q, (item, chunks) in enumerate(zip(qa, retrieved)):
+        targets = [t for t in map(normalize_query, [item['answer'], *item.get('evidence', [])]) if t]
+        ids = set(item.get('chunk_ids', []))
+        for k, chunk in enumerate(chunks[:top_k]):
+            text = normalized.get(chunk[1])
+            if text is None:
+                text = normalized[chunk[1]] = normalize_query(chunk[1])
+            relevant[q, k] = chunk[0] in ids or any(t in text for t in targets)
+    return relevant
+
+def _context_embeddings(retrieved, top_k):
+    """
+    Gathers the stored vectors of each question's retrieved chunks into a
+    (questions, top_k, dim) array plus the mask of rows that were found.
+    """
+    from rag.vector_store import get_vector_store
+    rows, matrix = get_vector_store().chunk_embeddings()
+    # chunk_id is only unique within one document
+    row_by_key = {(doc_id, chunk_id): i for i, (doc_id, chunk_id, _) in enumerate(rows)}
+    index = np.full((len(retrieved), top_k), -1, dtype=np.int64)
+    for q, chunks in enumerate(retrieved):
+        for k, chunk in enumerate(chunks[:top_k]):
+            index[q, k] = row_by_key.get((chunk[3], chunk[0]), -1)
+    mask = index >= 0
+    dim = matrix.shape[1] if matrix.ndim == 2 and matrix.shape[1] else 768
+    flat = np.unique(index[mask])
+    # Only the referenced rows are read, so a memory-mapped store is never loaded whole
+    gathered = np.asarray(matrix[flat], dtype=np.float32).reshape(len(flat), dim)
+    contexts = np.zeros((*index.shape, dim), dtype=np.float32)
+    contexts[mask] = gathered[np.searchsorted(flat, index[mask])]
+    return contexts, mask
+
+def _answer_embeddings(answers):
+    from rag.embedding import embed_chunks
+    # Embedded as documents, the same task type as the stored chunks they are compared with,
+    # but kept out of the embedding cache so they never evict real chunk vectors
+    embedded = embed_chunks(answers, use_cache=False)
+    vectors = np.zeros((len(answers), 768), dtype=np.float32)
+    valid = np.zeros(len(answers), dtype=bool)
+    for i, _, emb in embedded:
+        vectors[i] = emb
+        valid[i] = True
+    return vectors, valid
+
+def _generate_answers(questions, retrieved):
+    from rag.generator import generate_answer, GENERATION_MAX_CONCURRENCY
+    with ThreadPoolExecutor(max_workers=max(GENERATION_MAX_CONCURRENCY, 1)) as executor:
+        return list(executor.map(generate_answer, questions, retrieved))
+
+def _summary(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    return {
+        'mean': round(float(values.mean()), 4),
+        'p10': round(float(np.percentile(values, 10)), 4),
+        'p50': round(float(np.percentile(values, 50)), 4),
+    }
+
+def run_evaluation(qa, top_k=4, mode=None, generate=False, details=False):
+    """
+    Retrieves for every question in one batch and scores the run. Without generate,
+    groundedness is that of the expected answers against the retrieved context and
+    answer match is not computed. Returns a report dict.
+    """
+    from rag.retriever import retrieve_relevant_chunks_batch, RETRIEVAL_MODE
+    if not qa:
+        raise ValueError("The Q&A set contains no questions.")
+    mode = mode or RETRIEVAL_MODE
+    questions = [item['question'] for item in qa]
+    expected = [item['answer'] for item in qa]
+    timings = {}
+
+    started = time.perf_counter()
+    _, retrieved = retrieve_relevant_chunks_batch(questions, top_k=top_k, mode=mode)
+    timings['retrieve_s'] = time.perf_counter() - started
+
+    answers = expected
+    if generate:
+        started = time.perf_counter()
+        answers = _generate_answers(questions, retrieved)
+        timings['generate_s'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    answer_embeddings, valid = _answer_embeddings(answers)
+    timings['embed_answers_s'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    contexts, mask = _context_embeddings(retrieved, top_k)
+    grounded = groundedness_scores(answer_embeddings, contexts, mask & valid[:, None])
+    ranks = rank_metrics(relevance_matrix(qa, retrieved, top_k))
+    matches = answer_match(answers, expected) if generate else None
+    timings['score_s'] = time.perf_counter() - started
+
+    report = {
+        'questions': len(qa),
+        'top_k': top_k,
+        'mode': mode,
+        'answer_source': 'generated' if generate else 'expected',
+        f'recall@{top_k}': round(ranks['recall'], 4),
+        f'precision@{top_k}': round(ranks['precision'], 4),
+        'mrr': round(ranks['mrr'], 4),
+        'groundedness': _summary(grounded),
+        'answer_match': round(float(matches.mean()), 4) if matches is not None and len(matches) else None,
+        'timings': {k: round(v, 4) for k, v in timings.items()},
+    }
+    if details:
+        report['results'] = [
+            {
+                'question': question,
+                'first_relevant_rank': int(rank) if rank >= 0 else None,
+                'groundedness': None if np.isnan(g) else round(float(g), 4),
+                **({'answer': answer, 'answer_match': bool(m)} if matches is not None else {}),
+            }
+            for question, rank, g, answer, m in zip(
+                questions, ranks['first_ranks'], grounded, answers,
+                matches if matches is not None else [None] * len(qa)
+            )
+        ]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval and answers over a Q&A file.")
+    parser.add_argument('--qa', default=os.path.join(os.path.dirname(__file__), '..', 'bench', 'sample_qa.json'))
+    parser.add_argument('--top-k', type=int, default=4)
+    parser.add_argument('--mode', default=None, help="vector, hybrid or lexical (default: RETRIEVAL_MODE)")
+    parser.add_argument('--generate', action='store_true', help="Generate answers with Gemini and score them")
+    parser.add_argument('--details', action='store_true', help="Include per-question results")
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    qa = load_qa(args.qa)
+    if not qa:
+        parser.error(f"{args.qa} contains no questions.")
+    report = run_evaluation(qa, top_k=args.top_k, mode=args.mode, generate=args.generate, details=args.details)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
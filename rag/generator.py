@@ -1,28 +1,61 @@
 import os
-import google.generativeai as genai
+import threading
 from dotenv import load_dotenv
+import time
+from rag.context import pack_context
+from rag.metrics import metrics, span, count_call
+from rag.log import get_logger, request_debug
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables.")
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Using 'gemini-1.5-flash-latest' as per your existing code
+GENERATION_MODEL = "models/gemini-1.5-flash-latest"
 
-# Initialize the generative model. Using 'gemini-1.5-flash-latest' as per your existing code.
-generation_model = genai.GenerativeModel("models/gemini-1.5-flash-latest")
+# Upper bound on concurrent generation calls from the async API path
+GENERATION_MAX_CONCURRENCY = int(os.getenv('GENERATION_MAX_CONCURRENCY', '8'))
 
-def generate_answer(query, retrieved_chunks):
+GENERATION_CONFIG = {"temperature": 0.0}
+
+log = get_logger(__name__)
+
+# Created by get_generation_model() on first use; tests and benchmarks may assign a stand-in
+generation_model = None
+_model_lock = threading.Lock()
+
+def get_generation_model():
     """
-    Generates an answer based on a query and retrieved context chunks
-    using the Gemini generative model, with a focus on exactness.
+    Returns the shared Gemini model, importing and configuring google.generativeai
+    on first use so that importing this module stays cheap and needs no credentials.
     """
-    context = '\n'.join([chunk[1] for chunk in retrieved_chunks])
+    global generation_model
+    if generation_model is None:
+        with _model_lock:
+            if generation_model is None:
+                if not GEMINI_API_KEY:
+                    raise ValueError("GEMINI_API_KEY not found in environment variables.")
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                generation_model = genai.GenerativeModel(GENERATION_MODEL)
+    return generation_model
+
+def build_prompt(query, retrieved_chunks, usage=None):
+    # Neighbouring chunks are merged, repeated sentences dropped and the result cut to CONTEXT_MAX_TOKENS
+    with span('context_pack'):
+        packed = pack_context(retrieved_chunks)
+    context = packed.text
+    request_debug(log, "Packed %d chunks into ~%d context tokens (~%d unpacked).", len(retrieved_chunks), packed.tokens, packed.raw_tokens)
+    if usage is not None:
+        usage.update(
+            context_tokens=packed.tokens,
+            raw_context_tokens=packed.raw_tokens,
+            context_chunk_ids=packed.chunk_ids,
+        )
     
     # CRITICAL CHANGE: Enhance the prompt for exactness and conciseness
     # Add clear instructions for the model's behavior.
-    prompt = f"""
+    return f"""
     You are a helpful and precise assistant. Your goal is to provide exact answers
     based *only* on the given context.
 
@@ -39,14 +72,97 @@ def generate_answer(query, retrieved_chunks):
     Exact Answer:
     """
 
+def _record_usage(response, usage):
+    """
+    Copies Gemini's billed token counts into usage, when the response reports them.
+    """
+    metadata = getattr(response, 'usage_metadata', None)
+    if usage is None or metadata is None:
+        return
+    usage['prompt_tokens'] = getattr(metadata, 'prompt_token_count', None)
+    usage['output_tokens'] = getattr(metadata, 'candidates_token_count', None)
+    request_debug(log, "Generation used %s prompt and %s output tokens.", usage['prompt_tokens'], usage['output_tokens'])
+
+def generate_answer(query, retrieved_chunks, usage=None):
+    """
+    Generates an answer based on a query and retrieved context chunks
+    using the Gemini generative model, with a focus on exactness.
+    If usage is a dict it is filled with context and token counts for the call.
+    """
+    prompt = build_prompt(query, retrieved_chunks, usage)
+
     try:
         # CRITICAL CHANGE: Set temperature to 0.0 for deterministic, less creative answers.
         # This will make the model more factual and less prone to hallucination or conversational tones.
-        response = generation_model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(temperature=0.0)
-        )
+        with span('generate'):
+            response = get_generation_model().generate_content(prompt, generation_config=GENERATION_CONFIG)
+        count_call('gemini_generation', 'ok')
+        _record_usage(response, usage)
+        return response.text
+    except Exception as e:
+        count_call('gemini_generation', 'error')
+        log.error("Gemini Generation API call failed. Error: %s", e)
+        return f"[Error] Gemini Generation API: {e}"
+
+async def agenerate_answer(query, retrieved_chunks, limiter=None, usage=None):
+    """
+    Async generate_answer using the model's native async API. limiter is an
+    optional asyncio.Semaphore bounding concurrent generation calls.
+    """
+    prompt = build_prompt(query, retrieved_chunks, usage)
+
+    try:
+        with span('generate'):
+            if limiter is not None:
+                async with limiter:
+                    response = await get_generation_model().generate_content_async(prompt, generation_config=GENERATION_CONFIG)
+            else:
+                response = await get_generation_model().generate_content_async(prompt, generation_config=GENERATION_CONFIG)
+        count_call('gemini_generation', 'ok')
+        _record_usage(response, usage)
         return response.text
     except Exception as e:
-        print(f"ERROR: Gemini Generation API call failed. Error: {e}")
-        return f"[Error] Gemini Generation API: {e}"
\ No newline at end of file
+        count_call('gemini_generation', 'error')
+        log.error("Gemini Generation API call failed. Error: %s", e)
+        return f"[Error] Gemini Generation API: {e}"
+
+async def astream_answer(query, retrieved_chunks, limiter=None, usage=None):
+    """
+    Streams the answer as text fragments using the model's streaming mode.
+    The limiter slot (if any) is held until the stream finishes; usage is
+    complete once the generator is exhausted.
+    """
+    prompt = build_prompt(query, retrieved_chunks, usage)
+
+    # Timed by hand rather than with span(): the client may stop consuming mid-stream
+    started = time.perf_counter()
+    first_token = True
+    if limiter is not None:
+        await limiter.acquire()
+    try:
+        response = await get_generation_model().generate_content_async(
+            prompt, generation_config=GENERATION_CONFIG, stream=True
+        )
+        part = None
+        async for part in response:
+            # Parts without text (e.g. safety metadata only) raise on .text
+            try:
+                text = part.text
+            except ValueError:
+                continue
+            if text:
+                if first_token:
+                    metrics.observe('generate_first_token', time.perf_counter() - started)
+                    first_token = False
+                yield text
+        # The final part carries the token totals for the whole stream
+        _record_usage(part, usage)
+        count_call('gemini_generation', 'ok')
+        metrics.observe('generate', time.perf_counter() - started)
+    except Exception as e:
+        count_call('gemini_generation', 'error')
+        log.error("Gemini Generation API streaming call failed. Error: %s", e)
+        yield f"[Error] Gemini Generation API: {e}"
+    finally:
+        if limiter is not None:
+            limiter.release()
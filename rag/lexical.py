@@ -0,0 +1,141 @@
+import os
+import re
+import math
+import time
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from dotenv import load_dotenv
+from rag.log import get_logger
+
+load_dotenv()
+
+# 'vector' (dense only), 'hybrid' (dense + BM25 fused with RRF) or 'lexical' (BM25 only, no embedding call)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vector')
+# Candidates taken from each retriever before fusion
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))
+# In hybrid mode on the async path, answer from the lexical index alone if the query
+# embedding takes longer than this (seconds)
+HYBRID_EMBED_TIMEOUT = float(os.getenv('HYBRID_EMBED_TIMEOUT', '2'))
+# Reciprocal-rank fusion constant; larger values flatten the advantage of top ranks
+RRF_K = int(os.getenv('RRF_K', '60'))
+# How often (seconds) to ask the vector store whether the corpus was re-ingested
+LEXICAL_INDEX_CHECK_INTERVAL = float(os.getenv('LEXICAL_INDEX_CHECK_INTERVAL', '5'))
+
+log = get_logger(__name__)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r'[\u0980-\u09FF]+|[A-Za-z0-9]+')
+# Common Bangla case/plural/definiteness endings, longest first so 'গুলোকে' wins over 'কে'
+_BANGLA_SUFFIXES = sorted([
+    'গুলোকে', 'গুলোর', 'গুলো', 'গুলির', 'গুলি', 'দেরকে', 'দের', 'েরা', 'ের', 'রা',
+    'কে', 'তে', 'েতে', 'টির', 'টার', 'টি', 'টা', 'য়', 'র', 'ে',
+], key=len, reverse=True)
+_MIN_STEM_LENGTH = 2
+
+
+def _stem(token):
+    if not '\u0980' <= token[0] <= '\u09FF':
+        return token
+    for suffix in _BANGLA_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """
+    Bangla-aware tokens for the lexical index: NFC-normalized, case-folded Bangla
+    and ASCII alphanumeric runs, with common Bangla inflections stripped so that
+    'শুম্ভুনাথের' and 'শুম্ভুনাথ' match.
+    """
+    text = unicodedata.normalize('NFC', text).casefold()
+    return [_stem(t) for t in _TOKEN_PATTERN.findall(text)]
+
+
+class LexicalIndex:
+    """
+    In-process BM25 inverted index over chunk texts.
+
+    Results use the vector store's (chunk_id, text, distance, doc_id) shape, with the
+    negated BM25 score as distance so smaller is still better.
+    """
+
+    def __init__(self, rows, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.chunks = [(chunk_id, text, doc_id) for doc_id, chunk_id, text in rows]
+        self._postings = defaultdict(list)  # token -> [(chunk index, term frequency)]
+        self._lengths = []
+        for i, (_, text, _) in enumerate(self.chunks):
+            counts = Counter(tokenize(text))
+            self._lengths.append(sum(counts.values()))
+            for token, tf in counts.items():
+                self._postings[token].append((i, tf))
+        n = len(self.chunks)
+        self._avg_length = sum(self._lengths) / n if n else 0.0
+        self._idf = {
+            token: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self._postings.items()
+        }
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, top_k=4):
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            idf = self._idf.get(token)
+            if idf is None:
+                continue
+            for i, tf in self._postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[i] / self._avg_length)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.chunks[i][0], self.chunks[i][1], -score, self.chunks[i][2]) for i, score in best]
+
+
+def reciprocal_rank_fusion(result_lists, top_k=4, k=RRF_K):
+    """
+    Fuses ranked (chunk_id, text, distance, doc_id) lists: each chunk scores the sum
+    of 1 / (k + rank) over the lists it appears in. Returns the top_k as
+    (chunk_id, text, -fused_score, doc_id), best first.
+    """
+    scores = {}
+    for results in result_lists:
+        for rank, (chunk_id, text, _, doc_id) in enumerate(results, start=1):
+            # chunk_id alone is only unique within one document
+            key = (chunk_id, text, doc_id)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [(chunk_id, text, -score, doc_id) for (chunk_id, text, doc_id), score in best]
+
+
+_index = None
+_index_version = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_lexical_index(store):
+    """
+    Returns the lexical index for the store's current corpus. The corpus version is
+    checked at most every LEXICAL_INDEX_CHECK_INTERVAL seconds and the index is
+    rebuilt when it changes. Blocking; async callers run it in a thread.
+    """
+    global _index, _index_version, _index_checked_at
+    if _index is not None and time.monotonic() - _index_checked_at < LEXICAL_INDEX_CHECK_INTERVAL:
+        return _index
+    with _index_lock:
+        if _index is not None and time.monotonic() - _index_checked_at < LEXICAL_INDEX_CHECK_INTERVAL:
+            return _index
+        version = store.corpus_version()
+        if _index is None or version != _index_version:
+            started = time.perf_counter()
+            _index = LexicalIndex(store.chunk_texts())
+            _index_version = version
+            log.info("Built lexical index over %d chunks (corpus version %s) in %.2fs.", len(_index), version, time.perf_counter() - started)
+        _index_checked_at = time.monotonic()
+        return _index
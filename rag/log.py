@@ -0,0 +1,102 @@
+import os
+import sys
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# DEBUG, INFO, WARNING or ERROR for the rag.* and book.* loggers
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', '%(asctime)s %(levelname)s %(name)s: %(message)s')
+# Fraction of requests whose per-request DEBUG lines are written (when LOG_LEVEL=DEBUG)
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+
+_ROOT_LOGGERS = ('rag', 'book')
+
+# Whether the request being served was picked for per-request debug logging
+_request_sampled = contextvars.ContextVar('request_sampled', default=True)
+
+_records = queue.SimpleQueue()
+_listener = None
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def _start_listener():
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(logging.Formatter(LOG_FORMAT))
+        listener = QueueListener(_records, stream, respect_handler_level=True)
+        listener.start()
+        # Flush queued records on interpreter exit
+        atexit.register(listener.stop)
+        _listener = listener
+
+
+class _QueueHandler(QueueHandler):
+    """
+    QueueHandler that starts the writer thread with the first record it sees, so
+    importing modules that log starts no threads.
+    """
+
+    def enqueue(self, record):
+        if _listener is None:
+            _start_listener()
+        super().enqueue(record)
+
+
+def configure():
+    """
+    Routes the rag.* and book.* loggers through a QueueHandler. Callers only pay for
+    an enqueue; a background QueueListener thread, started on the first record,
+    formats records and writes them to stderr. Safe to call more than once.
+    """
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        for name in _ROOT_LOGGERS:
+            logger = logging.getLogger(name)
+            logger.setLevel(LOG_LEVEL)
+            logger.addHandler(_QueueHandler(_records))
+            # Uvicorn and other hosts configure the root logger; do not print twice
+            logger.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    """
+    Returns the logger for a module (pass __name__), configuring output on first use.
+    Use %-style arguments, e.g. log.debug("Found %d chunks", n), so messages are only
+    formatted when the level is enabled.
+    """
+    configure()
+    return logging.getLogger(name)
+
+
+def sample_request():
+    """
+    Decides whether the current request's DEBUG lines are logged, with probability
+    LOG_SAMPLE_RATE. Call once at the start of each request; the decision follows
+    the request into tasks and threads started from it.
+    """
+    sampled = LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+    _request_sampled.set(sampled)
+    return sampled
+
+
+def request_debug(logger, message, *args):
+    """
+    DEBUG line on the per-request path: dropped cheaply unless DEBUG is enabled and
+    the current request was sampled. Outside a request (CLI, ingestion) it always logs.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and _request_sampled.get():
+        logger.debug(message, *args)
@@ -1,26 +1,242 @@
 # REST API using Gemini for LLM and embeddings
-from fastapi import FastAPI, Request
-from pydantic import BaseModel
-from .retriever import retrieve_relevant_chunks
-from .generator import generate_answer
-from .memory import ShortTermMemory
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from .retriever import aembed_and_retrieve, aembed_and_retrieve_batch
+from .generator import agenerate_answer, astream_answer, get_generation_model, GENERATION_MAX_CONCURRENCY
+from .embedding import create_async_client, EMBED_MAX_CONCURRENCY
+from .vector_store import get_vector_store
+from .memory import get_memory
+from .answer_cache import AnswerCache, ANSWER_CACHE_ENABLED, normalize_query
+from .embedding_cache import get_cache
+from .metrics import metrics, span, start_request_timings
+from .singleflight import SingleFlight
+from .log import get_logger, sample_request
 
-app = FastAPI()
-memory = ShortTermMemory(max_length=10)
+log = get_logger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared clients are created once per worker, not per request
+    app.state.http_client = create_async_client()
+    app.state.vector_store = get_vector_store()
+    await app.state.vector_store.astart()
+    # Imports and configures the Gemini client here, so the first request does not pay for it
+    await asyncio.to_thread(get_generation_model)
+    # Limiters protect upstream quotas; requests queue here instead of tying up threads
+    app.state.embed_limiter = asyncio.Semaphore(EMBED_MAX_CONCURRENCY)
+    app.state.generate_limiter = asyncio.Semaphore(GENERATION_MAX_CONCURRENCY)
+    try:
+        yield
+    finally:
+        await app.state.vector_store.aclose()
+        await app.state.http_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+memory = get_memory()
+answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+
+# Identical /ask queries arriving while one is being answered share its retrieval and generation
+ASK_COALESCE_ENABLED = os.getenv('ASK_COALESCE_ENABLED', '1') == '1'
+ASK_TOP_K = 4
+ask_flight = SingleFlight('ask') if ASK_COALESCE_ENABLED else None
+
+# Upper bound on questions per /ask/batch request
+ASK_BATCH_MAX_QUERIES = int(os.getenv('ASK_BATCH_MAX_QUERIES', '500'))
+# Upper bound on chunks retrieved per question in /ask/batch
+ASK_BATCH_MAX_TOP_K = int(os.getenv('ASK_BATCH_MAX_TOP_K', '50'))
 
 class QueryRequest(BaseModel):
     user: str
     query: str
+    timings: bool = False # Include a per-stage latency breakdown (ms) in the response
+
+class BatchQueryRequest(BaseModel):
+    user: str
+    queries: List[str]
+    top_k: int = Field(4, ge=1, le=ASK_BATCH_MAX_TOP_K)
+    timings: bool = False
+
+async def _check_corpus_version():
+    # Rate-limited so the version lookup stays off the per-request path
+    if answer_cache is not None and answer_cache.needs_version_check():
+        try:
+            answer_cache.set_corpus_version(await asyncio.to_thread(app.state.vector_store.corpus_version))
+        except Exception as e:
+            log.warning("Could not read corpus version, answer cache cleared: %s", e)
+            answer_cache.set_corpus_version(None)
+
+async def _retrieve(query, top_k=ASK_TOP_K):
+    await _check_corpus_version()
+    with span('retrieve'):
+        return await aembed_and_retrieve(query, app.state.http_client, top_k=top_k, limiter=app.state.embed_limiter)
+
+async def _remember(user, query):
+    # Resolves a follow-up against this user's earlier questions, then records the question
+    with span('memory'):
+        return await memory.aremember(user, query)
+
+def _lookup_answer(query, query_embedding, retrieved):
+    if answer_cache is None:
+        return None
+    with span('answer_cache'):
+        return answer_cache.lookup(query, query_embedding, retrieved)
+
+async def _answer(query, top_k=ASK_TOP_K):
+    """
+    Retrieval, answer cache lookup and generation for one query. Returns
+    (retrieved, answer, usage); usage is empty when the answer came from the cache.
+    """
+    query_embedding, retrieved = await _retrieve(query, top_k)
+    answer = _lookup_answer(query, query_embedding, retrieved)
+    usage = {}
+    if answer is None:
+        answer = await agenerate_answer(query, retrieved, limiter=app.state.generate_limiter, usage=usage)
+        if answer_cache is not None:
+            answer_cache.store(query, query_embedding, retrieved, answer)
+    return retrieved, answer, usage
 
 @app.post("/ask")
-def ask(request: QueryRequest):
-    memory.add(request.user, request.query)
-    retrieved = retrieve_relevant_chunks(request.query, top_k=4)
-    answer = generate_answer(request.query, retrieved)
-    return {
+async def ask(request: QueryRequest):
+    sample_request()
+    timings = start_request_timings()
+    with span('ask'):
+        query = await _remember(request.user, request.query)
+        if ask_flight is None:
+            retrieved, answer, usage = await _answer(query)
+        else:
+            (retrieved, answer, usage), shared = await ask_flight.do(
+                (normalize_query(query), ASK_TOP_K), lambda: _answer(query)
+            )
+            # Tokens are billed to the request that started the computation
+            if shared:
+                usage = {}
+    response = {
         "answer": answer,
+        "query": query,
         "retrieved_chunks": [c[1] for c in retrieved],
-        "chat_history": memory.get_history()
+        "chat_history": await memory.aget_history(request.user),
+        "usage": usage
     }
+    if request.timings:
+        response["timings"] = timings
+    return response
+
+@app.post("/ask/batch")
+async def ask_batch(request: BatchQueryRequest):
+    """
+    Answers many questions at once: one batched embedding call, one vectorized
+    retrieval for all of them, then generation under the shared concurrency limit.
+    Results are returned in input order.
+    """
+    if len(request.queries) > ASK_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {ASK_BATCH_MAX_QUERIES} queries per batch.")
+    if any(not q.strip() for q in request.queries):
+        raise HTTPException(status_code=400, detail="Queries must not be empty.")
+    sample_request()
+    # Stage times are summed over all queries in the batch
+    timings = start_request_timings()
+    await _check_corpus_version()
+    with span('retrieve_batch'):
+        query_embeddings, retrieved = await aembed_and_retrieve_batch(
+            request.queries, app.state.http_client, top_k=request.top_k, limiter=app.state.embed_limiter
+        )
+
+    async def answer(query, query_embedding, chunks):
+        cached = _lookup_answer(query, query_embedding, chunks)
+        if cached is not None:
+            return cached, {}
+        usage = {}
+        result = await agenerate_answer(query, chunks, limiter=app.state.generate_limiter, usage=usage)
+        if answer_cache is not None:
+            answer_cache.store(query, query_embedding, chunks, result)
+        return result, usage
+
+    with span('generate_batch'):
+        answers = await asyncio.gather(*[
+            answer(q, emb, chunks) for q, emb, chunks in zip(request.queries, query_embeddings, retrieved)
+        ])
+    response = {
+        "results": [
+            {"query": q, "answer": a, "retrieved_chunks": [c[1] for c in chunks], "usage": usage}
+            for q, (a, usage), chunks in zip(request.queries, answers, retrieved)
+        ]
+    }
+    if request.timings:
+        response["timings"] = timings
+    return response
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_stream(request: QueryRequest):
+    """
+    Server-Sent Events variant of /ask: a "chunks" event with the retrieved
+    context, then one "token" event per generated fragment, then "done".
+    """
+    query = await _remember(request.user, request.query)
+
+    async def events():
+        # Set here: the response body is iterated in its own context
+        sample_request()
+        timings = start_request_timings()
+
+        async def done(answer, usage):
+            data = {"answer": answer, "chat_history": await memory.aget_history(request.user), "usage": usage}
+            if request.timings:
+                data["timings"] = timings
+            return _sse("done", data)
+
+        try:
+            query_embedding, retrieved = await _retrieve(query)
+            yield _sse("chunks", {"query": query, "retrieved_chunks": [c[1] for c in retrieved]})
+            cached = _lookup_answer(query, query_embedding, retrieved)
+            if cached is not None:
+                yield _sse("token", {"text": cached})
+                yield await done(cached, {})
+                return
+            answer = []
+            usage = {}
+            async for text in astream_answer(query, retrieved, limiter=app.state.generate_limiter, usage=usage):
+                answer.append(text)
+                yield _sse("token", {"text": text})
+            answer = "".join(answer)
+            if answer_cache is not None:
+                answer_cache.store(query, query_embedding, retrieved, answer)
+            yield await done(answer, usage)
+        except Exception as e:
+            log.error("Streaming /ask failed: %s", e)
+            yield _sse("error", {"detail": str(e)})
+
+    # X-Accel-Buffering stops nginx-style proxies from holding back events
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/cache/stats")
+def cache_stats():
+    embedding_cache = get_cache()
+    return {
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "memory": memory.stats(),
+        "coalescing": ask_flight.stats() if ask_flight is not None else None,
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """
+    Per-stage latency histograms and p50/p95/p99, plus external call, retry and
+    error counters, in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/summary")
+def metrics_summary():
+    return metrics.snapshot()
 
-# Add evaluation endpoint as needed
\ No newline at end of file
+# Add evaluation endpoint as needed
@@ -1,13 +1,271 @@
-from collections import deque
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+from rag.answer_cache import normalize_query
 
-class ShortTermMemory:
-    def __init__(self, max_length=10):
-        self.history = deque(maxlen=max_length)
+load_dotenv()
 
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+# 'memory' keeps sessions in this process; 'sqlite' shares them between uvicorn workers
+MEMORY_BACKEND = os.getenv('MEMORY_BACKEND', 'memory')
+MEMORY_PATH = os.getenv('MEMORY_PATH', os.path.join(DATA_DIR, 'memory.sqlite3'))
+MEMORY_MAX_TURNS = int(os.getenv('MEMORY_MAX_TURNS', '10')) # Per user
+MEMORY_MAX_USERS = int(os.getenv('MEMORY_MAX_USERS', '10000')) # Least recently active sessions are evicted past this
+MEMORY_TTL = float(os.getenv('MEMORY_TTL', '1800')) # Seconds a session may stay idle
+MEMORY_MAX_MESSAGE_CHARS = int(os.getenv('MEMORY_MAX_MESSAGE_CHARS', '1000'))
+# Previous questions of the same user prepended to a follow-up before retrieval
+MEMORY_REWRITE_TURNS = int(os.getenv('MEMORY_REWRITE_TURNS', '1'))
+
+# Words that only make sense with an earlier question: pronouns and leading connectives
+_REFERRING_WORDS = {
+    'he', 'she', 'it', 'they', 'him', 'her', 'his', 'hers', 'its', 'them', 'their',
+    'this', 'that', 'these', 'those',
+    'সে', 'তিনি', 'তার', 'তাঁর', 'তাকে', 'তাঁকে', 'তারা', 'তাদের', 'তাঁদের',
+    'এটি', 'এটা', 'ওটা', 'সেটা', 'সেটি', 'এর', 'ওর', 'সেই', 'ওই', 'উনি', 'ওনার',
+}
+_LEADING_CONNECTIVES = {'and', 'also', 'then', 'so', 'আর', 'এবং', 'তাহলে', 'তবে'}
+# Queries this short ("why?", "and Kalyani?") are treated as follow-ups
+_FOLLOW_UP_MAX_TOKENS = 2
+
+
+def is_follow_up(query):
+    tokens = normalize_query(query).split()
+    if not tokens:
+        return False
+    return (
+        len(tokens) <= _FOLLOW_UP_MAX_TOKENS
+        or tokens[0] in _LEADING_CONNECTIVES
+        or any(token in _REFERRING_WORDS for token in tokens)
+    )
+
+
+class SessionMemory(ABC):
+    """
+    Recent questions per user. add() and get_history() only ever touch one user's
+    session; sessions idle for longer than ttl, or the least recently active beyond
+    max_users, are evicted.
+    """
+
+    @abstractmethod
     def add(self, user, message):
-        self.history.append((user, message))
+        """Appends message to the user's session, evicting old turns and sessions."""
+
+    @abstractmethod
+    def messages(self, user):
+        """Returns the user's recent messages, oldest first."""
+
+    def get_history(self, user):
+        return [(user, message) for message in self.messages(user)]
+
+    def rewrite(self, user, query, turns=MEMORY_REWRITE_TURNS):
+        """
+        Returns the query to retrieve and answer with: a follow-up ("what did he do
+        next?") is prefixed with this user's previous question(s) so retrieval sees
+        what it refers to; self-contained queries are returned unchanged. Call before
+        add() so the current question is not its own context.
+        """
+        if turns <= 0 or not is_follow_up(query):
+            return query
+        previous = self.messages(user)[-turns:]
+        return ' '.join([*previous, query]) if previous else query
+
+    def remember(self, user, query):
+        """
+        Rewrites query against the user's earlier questions, then records it.
+        Returns the rewritten query.
+        """
+        rewritten = self.rewrite(user, query)
+        self.add(user, query)
+        return rewritten
+
+    async def aremember(self, user, query):
+        # Backends that can wait on a lock or on disk run in a thread, off the event loop
+        return await asyncio.to_thread(self.remember, user, query)
+
+    async def aget_history(self, user):
+        return await asyncio.to_thread(self.get_history, user)
+
+    @abstractmethod
+    def stats(self):
+        """Returns session and message counts for GET /cache/stats."""
+
+
+class ShortTermMemory(SessionMemory):
+    """
+    In-process backend: an OrderedDict of user -> deque of messages, kept in
+    least-recently-active order, so append, lookup and eviction are O(1).
+    """
+
+    def __init__(self, max_length=MEMORY_MAX_TURNS, max_users=MEMORY_MAX_USERS, ttl=MEMORY_TTL):
+        self.max_length = max_length
+        self.max_users = max_users
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # user -> (deque of messages, last active)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _expire(self, now):
+        # The front is the least recently active session, so expired ones are popped from there
+        while self._sessions:
+            _, last_active = next(iter(self._sessions.values()))
+            if now - last_active <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, user, message):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.pop(user, None)
+            history = session[0] if session is not None else deque(maxlen=self.max_length)
+            history.append(message[:MEMORY_MAX_MESSAGE_CHARS])
+            self._sessions[user] = (history, now)
+            while len(self._sessions) > self.max_users:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def messages(self, user):
+        with self._lock:
+            self._expire(time.monotonic())
+            session = self._sessions.get(user)
+            return list(session[0]) if session is not None else []
+
+    async def aremember(self, user, query):
+        # A few dict operations under an uncontended lock: a thread hop would cost more
+        return self.remember(user, query)
+
+    async def aget_history(self, user):
+        return self.get_history(user)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": sum(len(history) for history, _ in self._sessions.values()),
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteMemory(SessionMemory):
+    """
+    Sessions in a local SQLite file, so every uvicorn worker on the host sees the
+    same history. Writes run in IMMEDIATE transactions, which serialize them across
+    processes; WAL keeps reads from blocking on a writer.
+    """
+
+    def __init__(self, path=MEMORY_PATH, max_length=MEMORY_MAX_TURNS, max_users=MEMORY_MAX_USERS, ttl=MEMORY_TTL):
+        self.path = path
+        self.max_length = max_length
+        self.max_users = max_users
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL;')
+        self._conn.execute('PRAGMA synchronous=NORMAL;')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                user TEXT PRIMARY KEY,
+                last_active REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active);')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user TEXT NOT NULL,
+                message TEXT NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS messages_user ON messages (user, id);')
+
+    def _evict(self, cur, now):
+        cur.execute("SELECT user FROM sessions WHERE last_active < ?", (now - self.ttl,))
+        evicted = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT COUNT(*) FROM sessions")
+        excess = cur.fetchone()[0] - len(evicted) - self.max_users
+        if excess > 0:
+            cur.execute(
+                "SELECT user FROM sessions WHERE last_active >= ? ORDER BY last_active LIMIT ?",
+                (now - self.ttl, excess)
+            )
+            evicted += [row[0] for row in cur.fetchall()]
+        if evicted:
+            cur.executemany("DELETE FROM sessions WHERE user = ?", [(u,) for u in evicted])
+            cur.executemany("DELETE FROM messages WHERE user = ?", [(u,) for u in evicted])
+            self.evictions += len(evicted)
+
+    def add(self, user, message):
+        now = time.time()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.execute(
+                    "INSERT INTO sessions (user, last_active) VALUES (?, ?) "
+                    "ON CONFLICT(user) DO UPDATE SET last_active = excluded.last_active",
+                    (user, now)
+                )
+                cur.execute("INSERT INTO messages (user, message) VALUES (?, ?)", (user, message[:MEMORY_MAX_MESSAGE_CHARS]))
+                cur.execute(
+                    "DELETE FROM messages WHERE user = ? AND id NOT IN "
+                    "(SELECT id FROM messages WHERE user = ? ORDER BY id DESC LIMIT ?)",
+                    (user, user, self.max_length)
+                )
+                self._evict(cur, now)
+                cur.execute("COMMIT")
+            except sqlite3.Error:
+                cur.execute("ROLLBACK")
+                raise
+
+    def messages(self, user):
+        with self._lock:
+            row = self._conn.execute("SELECT last_active FROM sessions WHERE user = ?", (user,)).fetchone()
+            if row is None or time.time() - row[0] > self.ttl:
+                return []
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE user = ? ORDER BY id DESC LIMIT ?", (user, self.max_length)
+            ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "sessions": self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+                "messages": self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+                "evictions": self.evictions,
+            }
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
 
-    def get_history(self):
-        return list(self.history)
+def get_memory():
+    """
+    Returns the process-wide session store selected by MEMORY_BACKEND.
+    """
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                if MEMORY_BACKEND == 'memory':
+                    _memory = ShortTermMemory()
+                elif MEMORY_BACKEND == 'sqlite':
+                    _memory = SQLiteMemory()
+                else:
+                    raise ValueError(f"MEMORY_BACKEND must be 'memory' or 'sqlite', got '{MEMORY_BACKEND}'.")
+    return _memory
 
-# Long-term memory is handled by the vector DB (see db.py) 
\ No newline at end of file
+# Long-term memory is handled by the vector DB (see db.py)
@@ -0,0 +1,197 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Latency buckets (seconds) for the Prometheus histograms
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Recent samples kept per stage for the p50/p95/p99 estimates
+METRICS_WINDOW = int(os.getenv('METRICS_WINDOW', '2048'))
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Stage -> milliseconds for the request being served, when a handler asked for a breakdown.
+# asyncio tasks and asyncio.to_thread copy the context, so nested stages report into the same dict.
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(STAGE_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=METRICS_WINDOW)
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(STAGE_BUCKETS, seconds)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        if not self.recent:
+            return {q: 0.0 for q in QUANTILES}
+        ordered = sorted(self.recent)
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+class Metrics:
+    """
+    In-process latency histograms per request stage plus labelled counters,
+    rendered in the Prometheus text exposition format. Each worker process keeps
+    its own numbers; Prometheus aggregates across workers when it scrapes them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}  # stage -> _Histogram
+        self._counters = {}  # (name, sorted label items) -> value
+        self._help = {}
+        self._gauges = {}  # name -> callable returning {key: number} or None
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = _Histogram()
+            histogram.observe(seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 3)
+
+    def inc(self, name, amount=1, help=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if help:
+                self._help.setdefault(name, help)
+
+    def register_gauges(self, name, collect):
+        """
+        Publishes the numeric values of the dict returned by collect() as
+        rag_<name>_<key> gauges, read when metrics are rendered. collect may
+        return None while its source does not exist.
+        """
+        with self._lock:
+            self._gauges[name] = collect
+
+    def _collect_gauges(self):
+        # Collectors take their own locks, so they run outside this one
+        with self._lock:
+            sources = list(self._gauges.items())
+        gauges = {}
+        for name, collect in sorted(sources):
+            try:
+                values = collect()
+            except Exception:
+                values = None
+            if values is not None:
+                gauges[name] = {k: v for k, v in values.items() if isinstance(v, (int, float))}
+        return gauges
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """
+        Returns {"stages": {stage: {count, mean_ms, p50_ms, p95_ms, p99_ms}},
+        "counters": {...}, "gauges": {name: {key: value}}}.
+        """
+        gauges = self._collect_gauges()
+        with self._lock:
+            stages = {}
+            for stage, histogram in sorted(self._stages.items()):
+                quantiles = histogram.quantiles()
+                stages[stage] = {
+                    "count": histogram.count,
+                    "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                    **{f"p{int(q * 100)}_ms": value * 1000 for q, value in quantiles.items()},
+                }
+            counters = {
+                name + (('{' + ','.join(f'{k}={v}' for k, v in labels) + '}') if labels else ''): value
+                for (name, labels), value in sorted(self._counters.items())
+            }
+        return {"stages": stages, "counters": counters, "gauges": gauges}
+
+    def render(self):
+        """
+        Prometheus text format: rag_stage_duration_seconds histograms, a
+        rag_stage_duration_quantile_seconds gauge over the recent window, counters,
+        and the registered gauges.
+        """
+        gauges = self._collect_gauges()
+        lines = []
+        with self._lock:
+            lines.append("# HELP rag_stage_duration_seconds Time spent in each stage of the request path.")
+            lines.append("# TYPE rag_stage_duration_seconds histogram")
+            for stage, histogram in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(STAGE_BUCKETS, histogram.buckets):
+                    cumulative += count
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f"# HELP rag_stage_duration_quantile_seconds Stage latency quantiles over the last {METRICS_WINDOW} samples.")
+            lines.append("# TYPE rag_stage_duration_quantile_seconds gauge")
+            for stage, histogram in sorted(self._stages.items()):
+                for q, value in histogram.quantiles().items():
+                    lines.append(f'rag_stage_duration_quantile_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter != name:
+                        continue
+                    label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        for source, values in gauges.items():
+            for key, value in sorted(values.items()):
+                lines.append(f"# TYPE rag_{source}_{key} gauge")
+                lines.append(f"rag_{source}_{key} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(stage):
+    """
+    Times the enclosed block as one observation of stage. Exceptions are counted in
+    rag_stage_errors_total and re-raised.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        metrics.inc('rag_stage_errors_total', help="Stages that ended with an exception.", stage=stage)
+        raise
+    finally:
+        metrics.observe(stage, time.perf_counter() - started)
+
+
+def count_call(service, outcome):
+    metrics.inc('rag_external_calls_total', help="Calls to external services by outcome.", service=service, outcome=outcome)
+
+
+def count_retry(service):
+    metrics.inc('rag_external_retries_total', help="Retried calls to external services.", service=service)
+
+
+def start_request_timings():
+    """
+    Starts collecting a per-stage breakdown (in ms) for the current request and
+    returns the dict that stages will fill in.
+    """
+    timings = {}
+    _request_timings.set(timings)
+    return timings
@@ -1,46 +1,134 @@
 # Pipeline uses Gemini embeddings
 import os
 import sys
+import time
 sys.path.append(os.path.dirname(__file__))
-from book import preprocess, chunker
-from rag import embedding, db
+from rag.vector_store import get_vector_store
+from rag.embedding_cache import text_hash
+from rag.log import get_logger
+
+log = get_logger(__name__)
 
 BOOK_DIR = os.path.join(os.path.dirname(__file__), '../book')
 
-# Step 1: Preprocess PDF
-print('Extracting and cleaning text from PDF...')
-preprocess.extract_text_from_pdf()
-
-# Step 2: Chunk text
-print('Chunking text...')
-with open(os.path.join(BOOK_DIR, 'cleaned_text.txt'), 'r', encoding='utf-8') as f:
-    text = f.read()
-chunks = chunker.chunk_text(text)
-print(f"DEBUG: Number of chunks created: {len(chunks)}") # DEBUG PRINT
-
-# Step 3: Embed chunks
-print('Embedding chunks...')
-embedded = embedding.embed_chunks(chunks)
-print(f"DEBUG: Number of embedded chunks: {len(embedded)}") # DEBUG PRINT
-if embedded:
-    print(f"DEBUG: First embedded chunk (id, text_start, embedding_length): {embedded[0][0]}, {embedded[0][1][:50]}..., len={len(embedded[0][2])}") # DEBUG PRINT
-
-# Step 4: Store in DB
-print('Creating DB tables (if needed)...')
-db.create_tables()
-print('Inserting chunks into DB...')
-db.insert_chunks(embedded)
-print('DEBUG: insert_chunks call completed.') # DEBUG PRINT
-
-print('Pipeline complete!')
+
+def ingest(pdf_path=None):
+    """
+    Extracts, chunks, embeds and stores one PDF (default: the bundled book) as its
+    own document. Returns counts and per-step wall times (seconds) for the run.
+    Raises ValueError if no text could be extracted or some changed chunks could not
+    be embedded, leaving the stored copy as is.
+    """
+    # pdfplumber and the embedding client are only needed here, not by importers of RAGPipeline
+    from book import preprocess, chunker
+    from rag import embedding
+    pdf_path = pdf_path or preprocess.PDF_PATH
+    stats = {}
+    started = time.perf_counter()
+
+    # Steps 1-2: Extract pages in parallel and pack their sentences into chunks as they stream in
+    log.info('Extracting, cleaning and chunking text from PDF...')
+    records = list(chunker.chunk_sentences(preprocess.iter_pages(pdf_path)))
+    chunks = [record.text for record in records]
+    page_stats = preprocess.iter_pages.last_stats or {}
+    stats.update(pages=page_stats.get('pages', 0), page_cache_hits=page_stats.get('hits', 0), chunks=len(chunks))
+    # Extraction and chunking are streamed together, so they are timed as one step
+    stats['extract_s'] = time.perf_counter() - started
+    log.info("Number of chunks created: %d", len(chunks))
+    if not chunks:
+        raise ValueError(f"No text extracted from {pdf_path}; refusing to replace the stored document.")
+
+    # Step 3: Diff against the stored version of this document
+    doc_id = os.path.splitext(os.path.basename(pdf_path))[0]
+    log.info('Creating vector store (if needed)...')
+    store = get_vector_store()
+    store.create()
+    stored = store.get_document_chunks(doc_id)
+    stored_ids = sorted((chunk_id, content_hash) for content_hash, (chunk_id, _) in stored.items())
+    hashes = [text_hash(chunk) for chunk in chunks]
+    changed = [i for i, h in enumerate(hashes) if h not in stored]
+    removed = len(set(stored) - set(hashes))
+    log.info("Document '%s': %d unchanged, %d new/changed, %d removed chunks.", doc_id, len(chunks) - len(changed), len(changed), removed)
+    stats.update(changed=len(changed), removed=removed, embed_s=0.0, store_s=0.0)
+
+    if sorted(enumerate(hashes)) == stored_ids:
+        log.info('Document unchanged, nothing to ingest.')
+    else:
+        # Step 4: Embed only the chunks whose text is not already stored
+        log.info('Embedding chunks...')
+        step = time.perf_counter()
+        fresh = embedding.embed_chunks([chunks[i] for i in changed])
+        stats['embed_s'] = time.perf_counter() - step
+        log.info("Number of embedded chunks: %d", len(fresh))
+        if len(fresh) != len(changed):
+            # embed_chunks skips batches that fail after their retries; a partial replace would drop those chunks
+            raise ValueError(
+                f"Only {len(fresh)} of {len(changed)} changed chunks of '{doc_id}' were embedded; "
+                "refusing to replace the stored document."
+            )
+        vectors = {changed[j]: emb for j, _, emb in fresh}
+        for i, h in enumerate(hashes):
+            if i not in vectors and h in stored:
+                vectors[i] = stored[h][1]
+        embedded = [
+            (i, chunks[i], vectors[i], (r.char_start, r.char_end, r.page_start, r.page_end))
+            for i, r in enumerate(records) if i in vectors
+        ]
+
+        # Step 5: Atomically replace the document's changed chunks in the store.
+        # The pgvector backend also builds the ANN index here once data is present.
+        log.info('Writing changed chunks to the vector store...')
+        step = time.perf_counter()
+        store.replace_document(doc_id, embedded)
+        stats['store_s'] = time.perf_counter() - step
+        log.debug('replace_document call completed.')
+
+    stats['total_s'] = time.perf_counter() - started
+    log.info('Pipeline complete!')
+    return stats
+
+
+def main():
+    # Each PDF is stored as its own document, so ingesting another book leaves the others untouched
+    try:
+        ingest(sys.argv[1] if len(sys.argv) > 1 else None)
+    except ValueError as e:
+        log.error("%s", e)
+        sys.exit(1)
+
 
 # rag/pipeline.py
 
 class RAGPipeline:
-    def __init__(self):
-        from rag import db
-        self.db = db
+    # Storage goes through get_vector_store(), so the numpy backend never needs psycopg2
+
+    def ask(self, query, top_k=4):
+        # Dense, hybrid or lexical search depending on RETRIEVAL_MODE
+        from rag.retriever import retrieve_relevant_chunks
+        return retrieve_relevant_chunks(query, top_k=top_k)
+
+    def ask_batch(self, queries, top_k=4, generate=True, max_concurrency=None):
+        """
+        Answers many questions at once: queries are embedded in batched calls, top_k
+        chunks for all of them come from one vectorized search, and answers are
+        generated on a bounded thread pool. Returns one dict per query, in input order.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from rag.retriever import retrieve_relevant_chunks_batch
+        from rag.generator import generate_answer, GENERATION_MAX_CONCURRENCY
+
+        _, retrieved = retrieve_relevant_chunks_batch(queries, top_k=top_k)
+        answers = [None] * len(queries)
+        if generate:
+            with ThreadPoolExecutor(max_workers=max_concurrency or GENERATION_MAX_CONCURRENCY) as executor:
+                answers = list(executor.map(generate_answer, queries, retrieved))
+        return [
+            {"query": q, "answer": a, "retrieved_chunks": chunks}
+            for q, a, chunks in zip(queries, answers, retrieved)
+        ]
+
 
-    def ask(self, query):
-        # load vector store and perform similarity search
-        return self.db.search_similar_chunks(query)
\ No newline at end of file
+if __name__ == "__main__":
+    # Guarded so process-pool workers (which re-import the main module on spawn platforms)
+    # and importers of RAGPipeline never trigger an ingestion run
+    main()
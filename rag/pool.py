@@ -0,0 +1,180 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool's wait timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections with a bounded wait.
+
+    Connections are created by connect_fn, kept between min_size and max_size,
+    and health-checked with a cheap query before being handed out if they have
+    been idle longer than check_interval seconds. Broken connections are
+    discarded and replaced transparently. observer, if given, is called with the
+    seconds each successful checkout took.
+    """
+
+    def __init__(self, connect_fn, min_size=1, max_size=10, timeout=5.0, check_interval=30.0, observer=None):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool bounds: min_size={min_size}, max_size={max_size}")
+        self._connect_fn = connect_fn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._observer = observer
+        self._idle = deque()  # (connection, last_used) pairs, most recently used on the right
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._waiting = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+        for _ in range(min_size):
+            self._idle.append((self._new_connection(), time.monotonic()))
+
+    def _new_connection(self):
+        conn = self._connect_fn()
+        with self._cond:
+            self._size += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1;')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed.")
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Timed out after {self.timeout:.1f}s waiting for a DB connection "
+                            f"({self._size}/{self.max_size} in use)."
+                        )
+                    self._waiting += 1
+                    waited = True
+                    self._cond.wait(remaining)
+                    self._waiting -= 1
+                if waited:
+                    wait = time.monotonic() - started
+                    self._wait_time_total += wait
+                    self._wait_time_max = max(self._wait_time_max, wait)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = self._connect_fn()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                continue
+
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._checkouts += 1
+                self._checkout_time_total += elapsed
+                self._checkout_time_max = max(self._checkout_time_max, elapsed)
+            if self._observer is not None:
+                self._observer(elapsed)
+            return conn
+
+    def putconn(self, conn):
+        if conn.closed:
+            self._discard(conn)
+            return
+        try:
+            # Never hand out a connection with an open or aborted transaction
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                conn.close()
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "max_size": self.max_size,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_time_total_s": self._wait_time_total,
+                "wait_time_max_s": self._wait_time_max,
+                "checkout_latency_avg_s": self._checkout_time_total / self._checkouts if self._checkouts else 0.0,
+                "checkout_latency_max_s": self._checkout_time_max,
+            }
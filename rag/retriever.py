@@ -1,13 +1,133 @@
-from rag.db import search_similar_chunks
-# No need to import embed_query here, as db.py will handle embedding the query
+import asyncio
+from rag.embedding import embed_query, aembed_query, embed_queries, aembed_queries
+from rag.vector_store import get_vector_store
+from rag.metrics import span
+from rag.log import get_logger, request_debug
+from rag.lexical import get_lexical_index, reciprocal_rank_fusion, RETRIEVAL_MODE, HYBRID_CANDIDATES, HYBRID_EMBED_TIMEOUT
 
-def retrieve_relevant_chunks(query_text, top_k=4):
+RETRIEVAL_MODES = ('vector', 'hybrid', 'lexical')
+
+log = get_logger(__name__)
+
+
+def _check_mode(mode):
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Retrieval mode must be one of {RETRIEVAL_MODES}, got '{mode}'.")
+
+def _lexical(query_texts, top_k):
+    with span('lexical_search'):
+        index = get_lexical_index(get_vector_store())
+        return [index.search(q, top_k=top_k) for q in query_texts]
+
+def _fuse(query_texts, dense_results, top_k):
+    lexical_results = _lexical(query_texts, HYBRID_CANDIDATES)
+    return [reciprocal_rank_fusion([d, l], top_k=top_k) for d, l in zip(dense_results, lexical_results)]
+
+def retrieve_relevant_chunks(query_text, top_k=4, mode=RETRIEVAL_MODE):
+    """
+    Retrieves the top_k most relevant chunks for a given query text from the
+    configured vector store (VECTOR_STORE=pgvector or numpy).
+
+    mode 'lexical' answers from the BM25 index without an embedding call; 'hybrid'
+    fuses dense and BM25 candidates with reciprocal-rank fusion and falls back to
+    BM25 alone if the query cannot be embedded.
+    """
+    _check_mode(mode)
+    request_debug(log, "Retrieving relevant chunks for query: '%s' (mode=%s)", query_text, mode)
+    if mode == 'lexical':
+        return _lexical([query_text], top_k)[0]
+    try:
+        _, _, query_embedding = embed_query(query_text)
+    except Exception as e:
+        if mode != 'hybrid':
+            raise
+        log.warning("Query embedding failed, answering from the lexical index only: %s", e)
+        return _lexical([query_text], top_k)[0]
+    if mode == 'vector':
+        with span('vector_search'):
+            return get_vector_store().search(query_embedding, top_k=top_k)
+    with span('vector_search'):
+        dense = get_vector_store().search(query_embedding, top_k=HYBRID_CANDIDATES)
+    return _fuse([query_text], [dense], top_k)[0]
+
+def retrieve_relevant_chunks_batch(query_texts, top_k=4, mode=RETRIEVAL_MODE):
+    """
+    Embeds all queries in batched calls and retrieves top_k chunks for each with one
+    vectorized search. Returns (query_embeddings, results) in input order; embeddings
+    are None where none was computed (lexical mode or hybrid fallback).
+    """
+    _check_mode(mode)
+    if mode == 'lexical':
+        return [None] * len(query_texts), _lexical(query_texts, top_k)
+    try:
+        query_embeddings = embed_queries(query_texts)
+    except Exception as e:
+        if mode != 'hybrid':
+            raise
+        log.warning("Query embedding failed, answering %d queries from the lexical index only: %s", len(query_texts), e)
+        return [None] * len(query_texts), _lexical(query_texts, top_k)
+    if mode == 'vector':
+        with span('vector_search'):
+            return query_embeddings, get_vector_store().search_batch(query_embeddings, top_k=top_k)
+    with span('vector_search'):
+        dense = get_vector_store().search_batch(query_embeddings, top_k=HYBRID_CANDIDATES)
+    return query_embeddings, _fuse(query_texts, dense, top_k)
+
+async def _aembed_for_mode(embed, mode, count):
+    """
+    Awaits a query-embedding coroutine. In hybrid mode a failure or a response slower
+    than HYBRID_EMBED_TIMEOUT yields None so the caller can serve lexical results.
+    """
+    if mode != 'hybrid':
+        return await embed
+    try:
+        return await asyncio.wait_for(embed, timeout=HYBRID_EMBED_TIMEOUT)
+    except Exception as e:
+        reason = f"timed out after {HYBRID_EMBED_TIMEOUT}s" if isinstance(e, asyncio.TimeoutError) else f"failed: {e}"
+        log.warning("Query embedding %s; answering %d queries from the lexical index only.", reason, count)
+        return None
+
+async def aembed_and_retrieve_batch(query_texts, client, top_k=4, limiter=None, mode=RETRIEVAL_MODE):
+    """
+    Async retrieve_relevant_chunks_batch.
+    """
+    _check_mode(mode)
+    if mode == 'lexical':
+        return [None] * len(query_texts), await asyncio.to_thread(_lexical, query_texts, top_k)
+    query_embeddings = await _aembed_for_mode(aembed_queries(client, query_texts, limiter=limiter), mode, len(query_texts))
+    if query_embeddings is None:
+        return [None] * len(query_texts), await asyncio.to_thread(_lexical, query_texts, top_k)
+    if mode == 'vector':
+        with span('vector_search'):
+            return query_embeddings, await get_vector_store().asearch_batch(query_embeddings, top_k=top_k)
+    with span('vector_search'):
+        dense = await get_vector_store().asearch_batch(query_embeddings, top_k=HYBRID_CANDIDATES)
+    return query_embeddings, await asyncio.to_thread(_fuse, query_texts, dense, top_k)
+
+async def aembed_and_retrieve(query_text, client, top_k=4, limiter=None, mode=RETRIEVAL_MODE):
+    """
+    Embeds the query over the shared httpx client (bounded by limiter) and searches
+    the vector store without blocking the event loop. Returns (query_embedding, chunks);
+    query_embedding is None when the chunks came from the lexical index alone.
+    """
+    _check_mode(mode)
+    request_debug(log, "Retrieving relevant chunks for query: '%s' (mode=%s)", query_text, mode)
+    if mode == 'lexical':
+        return None, (await asyncio.to_thread(_lexical, [query_text], top_k))[0]
+    embedded = await _aembed_for_mode(aembed_query(client, query_text, limiter=limiter), mode, 1)
+    if embedded is None:
+        return None, (await asyncio.to_thread(_lexical, [query_text], top_k))[0]
+    query_embedding = embedded[2]
+    if mode == 'vector':
+        with span('vector_search'):
+            return query_embedding, await get_vector_store().asearch(query_embedding, top_k=top_k)
+    with span('vector_search'):
+        dense = await get_vector_store().asearch(query_embedding, top_k=HYBRID_CANDIDATES)
+    return query_embedding, (await asyncio.to_thread(_fuse, [query_text], [dense], top_k))[0]
+
+async def aretrieve_relevant_chunks(query_text, client, top_k=4, limiter=None, mode=RETRIEVAL_MODE):
     """
-    Retrieves the top_k most relevant chunks for a given query text from the database.
-    The query text is embedded within search_similar_chunks.
+    Async retrieve_relevant_chunks.
     """
-    print(f"DEBUG: Retrieving relevant chunks for query: '{query_text}'")
-    # CRITICAL FIX: Pass the original query_text directly to search_similar_chunks.
-    # search_similar_chunks in db.py will now handle embedding the query internally.
-    results = search_similar_chunks(query_text, top_k=top_k)
-    return results
\ No newline at end of file
+    _, results = await aembed_and_retrieve(query_text, client, top_k=top_k, limiter=limiter, mode=mode)
+    return results
@@ -0,0 +1,47 @@
+import asyncio
+from rag.metrics import metrics
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls with the same key: the first caller starts the
+    computation and later callers await the same task instead of repeating it. The
+    key is forgotten as soon as the task finishes, so results are never reused
+    afterwards (that is the answer cache's job). Exceptions reach every waiter.
+    Per worker and per event loop; requests in other workers are not coalesced.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> asyncio.Task
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """
+        Returns (result, shared): shared is True when this caller joined a
+        computation started by another request.
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+            metrics.inc('rag_coalesced_requests_total', help="Requests that joined an identical in-flight request.", endpoint=self.name)
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded so a disconnecting caller does not cancel the work the others wait on
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,404 @@
+import os
+import json
+import glob
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+from dotenv import load_dotenv
+from rag.embedding_cache import text_hash
+from rag.metrics import metrics
+from rag.log import get_logger
+
+load_dotenv()
+
+log = get_logger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+# Backend behind retrieve_relevant_chunks: 'pgvector' (PostgreSQL) or 'numpy' (in-process)
+VECTOR_STORE = os.getenv('VECTOR_STORE', 'pgvector')
+VECTOR_STORE_PATH = os.getenv('VECTOR_STORE_PATH', os.path.join(DATA_DIR, 'vector_store'))
+DISTANCE_METRIC = os.getenv('DISTANCE_METRIC', 'inner_product')
+# Compact form searched before exact re-ranking: 'none', 'halfvec' (float16, pgvector
+# only) or 'binary' (sign bits compared by Hamming distance)
+VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none')
+# With quantization, top_k * RERANK_FACTOR candidates are re-ranked on the full vectors
+RERANK_FACTOR = int(os.getenv('RERANK_FACTOR', '4'))
+
+# Quantizations of the numpy backend. numpy has no fast float16 or int8 matrix product,
+# so scanning those forms was slower than the exact float32 scan; only sign bits pay off
+QUANTIZATIONS = ('none', 'binary')
+# Rows quantized or scored per step, bounding the float32 scratch memory of a scan
+_SCAN_BLOCK = 8192
+# Set bits per byte value, for Hamming distances on numpy < 2.0 (no np.bitwise_count)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _hamming(block, bits):
+    """Hamming distances between each row of packed sign bits in block and bits."""
+    if hasattr(np, 'bitwise_count') and block.shape[1] % 8 == 0:
+        # 64 bits per XOR/popcount instead of 8
+        return np.bitwise_count(block.view(np.uint64) ^ bits.view(np.uint64)).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[block ^ bits].sum(axis=1, dtype=np.int32)
+
+
+def quantize(matrix, kind):
+    """
+    Returns the compact search form of a float32 (n, dim) matrix as a tuple of arrays:
+    (packed sign bits,) for 'binary', or None for 'none'.
+    """
+    if kind == 'none':
+        return None
+    if kind not in QUANTIZATIONS:
+        raise ValueError(f"VECTOR_QUANTIZATION for the numpy backend must be one of {QUANTIZATIONS}, got '{kind}'.")
+    n, dim = matrix.shape
+    codes = (np.empty((n, (dim + 7) // 8), dtype=np.uint8),)
+    for start in range(0, n, _SCAN_BLOCK):
+        block = np.asarray(matrix[start:start + _SCAN_BLOCK], dtype=np.float32)
+        codes[0][start:start + len(block)] = np.packbits(block > 0, axis=1)
+    return codes
+
+
+def approximate_distances(queries, codes):
+    """
+    Hamming distances between the sign bits of each query and of every stored row.
+    They only order candidates for exact re-ranking.
+    """
+    n = len(codes[0])
+    distances = np.empty((len(queries), n), dtype=np.int32)
+    query_bits = np.packbits(queries > 0, axis=1)
+    for qi, bits in enumerate(query_bits):
+        for start in range(0, n, _SCAN_BLOCK):
+            block = codes[0][start:start + _SCAN_BLOCK]
+            distances[qi, start:start + len(block)] = _hamming(block, bits)
+    return distances
+
+
+class VectorStore(ABC):
+    """
+    Storage and top-k search over chunk embeddings.
+
+    Search results are (chunk_id, text, distance, doc_id) tuples, smallest distance first,
+    with distances matching pgvector's operator for DISTANCE_METRIC. Ingestion
+    replaces a document's chunks as a unit, mirroring db.replace_document.
+    """
+
+    @abstractmethod
+    def create(self):
+        """Creates the storage if it does not exist yet."""
+
+    def search(self, query_embedding, top_k=4):
+        return self.search_batch([query_embedding], top_k=top_k)[0]
+
+    @abstractmethod
+    def search_batch(self, query_embeddings, top_k=4):
+        """Returns one list of top_k results per query embedding, in input order."""
+
+    async def astart(self):
+        """Opens async resources (e.g. a DB pool); called once from the app lifespan."""
+
+    async def aclose(self):
+        """Releases resources opened by astart."""
+
+    async def asearch(self, query_embedding, top_k=4):
+        # Backends without a native async driver run the blocking search in a thread
+        return await asyncio.to_thread(self.search, query_embedding, top_k)
+
+    async def asearch_batch(self, query_embeddings, top_k=4):
+        return await asyncio.to_thread(self.search_batch, query_embeddings, top_k)
+
+    @abstractmethod
+    def get_document_chunks(self, doc_id):
+        """Returns {content_hash: (chunk_id, embedding)} for the stored chunks of doc_id."""
+
+    @abstractmethod
+    def replace_document(self, doc_id, chunks_with_embeddings):
+        """Atomically replaces every chunk of doc_id; returns the new corpus version."""
+
+    @abstractmethod
+    def corpus_version(self):
+        """Returns a value that changes whenever the stored corpus does."""
+
+    @abstractmethod
+    def chunk_texts(self):
+        """Returns every stored (doc_id, chunk_id, text), e.g. to build the lexical index."""
+
+    @abstractmethod
+    def chunk_embeddings(self):
+        """
+        Returns (rows, matrix): every stored (doc_id, chunk_id, text) and a float32
+        matrix of their embeddings in the same order, so evaluation can score against
+        stored vectors instead of re-embedding chunks.
+        """
+
+
+class PgVectorStore(VectorStore):
+    """PostgreSQL + pgvector backend; delegates to rag.db."""
+
+    def __init__(self):
+        # Imported lazily so the numpy backend never needs psycopg2 or a live database
+        from rag import db
+        self.db = db
+        self.async_pool = None
+
+    def create(self):
+        self.db.create_tables()
+
+    def search(self, query_embedding, top_k=4):
+        return self.db.search_by_embedding(query_embedding, top_k=top_k)
+
+    def search_batch(self, query_embeddings, top_k=4):
+        return self.db.search_by_embeddings(query_embeddings, top_k=top_k)
+
+    async def astart(self):
+        self.async_pool = await self.db.create_async_pool()
+        metrics.register_gauges('db_async_pool', lambda: self.db.async_pool_stats(self.async_pool))
+
+    async def aclose(self):
+        if self.async_pool is not None:
+            await self.async_pool.close()
+            self.async_pool = None
+
+    async def asearch(self, query_embedding, top_k=4):
+        if self.async_pool is None:
+            return await super().asearch(query_embedding, top_k=top_k)
+        return await self.db.asearch_by_embedding(self.async_pool, query_embedding, top_k=top_k)
+
+    async def asearch_batch(self, query_embeddings, top_k=4):
+        if self.async_pool is None:
+            return await super().asearch_batch(query_embeddings, top_k=top_k)
+        return await self.db.asearch_by_embeddings(self.async_pool, query_embeddings, top_k=top_k)
+
+    def get_document_chunks(self, doc_id):
+        return self.db.get_document_chunks(doc_id)
+
+    def replace_document(self, doc_id, chunks_with_embeddings):
+        version = self.db.replace_document(doc_id, chunks_with_embeddings)
+        self.db.ensure_vector_index()
+        return version
+
+    def corpus_version(self):
+        return self.db.get_corpus_version()
+
+    def chunk_texts(self):
+        return self.db.fetch_chunk_texts()
+
+    def chunk_embeddings(self):
+        rows = self.db.fetch_all_chunks()
+        matrix = np.asarray([row[3] for row in rows], dtype=np.float32).reshape(len(rows), -1)
+        return [(doc_id, chunk_id, text) for doc_id, chunk_id, text, *_ in rows], matrix
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process backend: all embeddings live in one contiguous float32 matrix,
+    memory-mapped from a .npy file, and search is a matrix product plus
+    argpartition top-k.
+
+    With binary quantization, a compact copy (packed sign bits) is built in memory
+    on load and scanned instead; only the top_k * rerank_factor candidates are read
+    from the float32 matrix and re-ranked exactly.
+
+    On disk a version is embeddings_v<N>.npy plus chunks_v<N>.json (doc_id,
+    chunk_id, content_hash, text, char_start, char_end, page_start, page_end per
+    row; stores written before offsets existed have only the first four).
+    manifest.json names the current version and is swapped with os.replace, so
+    readers never see a partial write.
+    """
+
+    def __init__(self, path=VECTOR_STORE_PATH, metric=DISTANCE_METRIC, quantization=VECTOR_QUANTIZATION, rerank_factor=RERANK_FACTOR):
+        if metric not in ('inner_product', 'cosine', 'l2'):
+            raise ValueError(f"Unsupported distance metric '{metric}'.")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"VECTOR_QUANTIZATION for the numpy backend must be one of {QUANTIZATIONS}, got '{quantization}'.")
+        self.path = path
+        self.metric = metric
+        self.quantization = quantization
+        self.rerank_factor = max(rerank_factor, 1)
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        # (version, matrix, row norms, rows, compact codes or None), swapped as one
+        # tuple so concurrent searches never mix two versions
+        self._state = (None, np.zeros((0, 768), dtype=np.float32), np.zeros(0, dtype=np.float32), [], None)
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.path, 'manifest.json')
+
+    def _load(self):
+        """
+        Returns the current state, (re)loading it if the manifest changed since the last load.
+        """
+        try:
+            stat = os.stat(self._manifest_path)
+        except FileNotFoundError:
+            return self._state
+        # os.replace gives every manifest a new inode, which catches swaps within one mtime tick
+        mtime = (stat.st_mtime_ns, stat.st_ino)
+        if mtime == self._manifest_mtime:
+            return self._state
+        with self._lock:
+            if mtime == self._manifest_mtime:
+                return self._state
+            with open(self._manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            version = manifest['version']
+            matrix = np.load(os.path.join(self.path, f'embeddings_v{version}.npy'), mmap_mode='r')
+            with open(os.path.join(self.path, f'chunks_v{version}.json'), 'r', encoding='utf-8') as f:
+                rows = json.load(f)
+            norms = np.linalg.norm(matrix, axis=1).astype(np.float32) if len(rows) else np.zeros(0, dtype=np.float32)
+            codes = quantize(matrix, self.quantization) if len(rows) else None
+            self._state = (version, matrix, norms, rows, codes)
+            self._manifest_mtime = mtime
+            log.info("Loaded vector store version %s with %d chunks from %s.", version, len(rows), self.path)
+            return self._state
+
+    def create(self):
+        os.makedirs(self.path, exist_ok=True)
+        if not os.path.exists(self._manifest_path):
+            self._write_version(1, np.zeros((0, 768), dtype=np.float32), [])
+
+    def _distances(self, queries, matrix, norms):
+        scores = queries @ matrix.T
+        if self.metric == 'inner_product':
+            return -scores
+        if self.metric == 'cosine':
+            query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            return 1.0 - scores / np.maximum(query_norms * norms, 1e-12)
+        query_sq = np.sum(queries * queries, axis=1, keepdims=True)
+        return np.sqrt(np.maximum(query_sq - 2.0 * scores + norms ** 2, 0.0))
+
+    def search_batch(self, query_embeddings, top_k=4):
+        _, matrix, norms, rows, codes = self._load()
+        if not rows or not len(query_embeddings) or top_k < 1:
+            return [[] for _ in query_embeddings]
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        k = min(top_k, len(rows))
+        if codes is not None:
+            return self._search_quantized(queries, k, matrix, norms, rows, codes)
+        distances = self._distances(queries, matrix, norms)
+        # argpartition finds the k best in O(n); only those k are sorted
+        candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        results = []
+        for qi, idx in enumerate(candidates):
+            idx = idx[np.argsort(distances[qi, idx])]
+            results.append([(rows[i][1], rows[i][3], float(distances[qi, i]), rows[i][0]) for i in idx])
+        return results
+
+    def _search_quantized(self, queries, k, matrix, norms, rows, codes):
+        """
+        Picks k * rerank_factor candidates per query by Hamming distance on the sign
+        bits, then re-ranks them with exact distances on the full-precision rows.
+        """
+        approximate = approximate_distances(queries, codes)
+        count = min(k * self.rerank_factor, len(rows))
+        candidates = np.argpartition(approximate, count - 1, axis=1)[:, :count]
+        results = []
+        for qi, idx in enumerate(candidates):
+            # Sorted indexes read the memory-mapped matrix front to back
+            idx = np.sort(idx)
+            exact = self._distances(queries[qi:qi + 1], np.asarray(matrix[idx]), norms[idx])[0]
+            best = np.argsort(exact)[:k]
+            results.append([(rows[idx[j]][1], rows[idx[j]][3], float(exact[j]), rows[idx[j]][0]) for j in best])
+        return results
+
+    async def asearch(self, query_embedding, top_k=4):
+        # Sub-millisecond and CPU-bound: a thread hop would cost more than the search
+        return self.search(query_embedding, top_k=top_k)
+
+    async def asearch_batch(self, query_embeddings, top_k=4):
+        return self.search_batch(query_embeddings, top_k=top_k)
+
+    def get_document_chunks(self, doc_id):
+        _, matrix, _, rows, _ = self._load()
+        return {
+            row[2]: (row[1], np.array(matrix[i]))
+            for i, row in enumerate(rows) if row[0] == doc_id
+        }
+
+    def replace_document(self, doc_id, chunks_with_embeddings):
+        self.create()
+        current_version, current_matrix, _, current_rows, _ = self._load()
+        keep = [i for i, row in enumerate(current_rows) if row[0] != doc_id]
+        new_rows = [current_rows[i] for i in keep]
+        new_rows += [
+            [doc_id, row[0], text_hash(row[1]), row[1], *(row[3] if len(row) > 3 else (None,) * 4)]
+            for row in chunks_with_embeddings
+        ]
+        parts = [np.asarray(current_matrix[keep], dtype=np.float32).reshape(len(keep), -1)] if keep else []
+        if chunks_with_embeddings:
+            parts.append(np.asarray([row[2] for row in chunks_with_embeddings], dtype=np.float32))
+        matrix = np.concatenate(parts) if parts else np.zeros((0, 768), dtype=np.float32)
+        version = (current_version or 0) + 1
+        self._write_version(version, matrix, new_rows)
+        log.info("Swapped vector store to version %s with %d chunks for document '%s'.", version, len(chunks_with_embeddings), doc_id)
+        return version
+
+    def _write_version(self, version, matrix, rows):
+        os.makedirs(self.path, exist_ok=True)
+        np.save(os.path.join(self.path, f'embeddings_v{version}.npy'), np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(os.path.join(self.path, f'chunks_v{version}.json'), 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False)
+        tmp = self._manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'count': len(rows), 'metric': self.metric}, f)
+        os.replace(tmp, self._manifest_path)
+        # Older versions are no longer referenced; open memory maps stay valid on POSIX
+        for old in glob.glob(os.path.join(self.path, 'embeddings_v*.npy')) + glob.glob(os.path.join(self.path, 'chunks_v*.json')):
+            if not old.endswith((f'_v{version}.npy', f'_v{version}.json')):
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def corpus_version(self):
+        return self._load()[0]
+
+    def chunk_texts(self):
+        return [(row[0], row[1], row[3]) for row in self._load()[3]]
+
+    def chunk_embeddings(self):
+        _, matrix, _, rows, _ = self._load()
+        return [(row[0], row[1], row[3]) for row in rows], matrix
+
+    def export_from_db(self):
+        """
+        Replaces the store's contents with the chunks currently stored in PostgreSQL.
+        """
+        from rag import db
+        rows = db.fetch_all_chunks()
+        matrix = np.asarray([row[3] for row in rows], dtype=np.float32).reshape(len(rows), -1)
+        self.create()
+        version = (self._load()[0] or 0) + 1
+        self._write_version(version, matrix, [
+            [doc_id, chunk_id, text_hash(text), text, *offsets] for doc_id, chunk_id, text, _, *offsets in rows
+        ])
+        log.info("Exported %d chunks from PostgreSQL into vector store version %s.", len(rows), version)
+        return version
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store():
+    """
+    Returns the process-wide vector store selected by VECTOR_STORE.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if VECTOR_STORE == 'numpy':
+                    _store = NumpyVectorStore()
+                elif VECTOR_STORE == 'pgvector':
+                    _store = PgVectorStore()
+                else:
+                    raise ValueError(f"VECTOR_STORE must be 'pgvector' or 'numpy', got '{VECTOR_STORE}'.")
+    return _store
+
+
+if __name__ == "__main__":
+    # Build the numpy backend from the chunks already ingested into PostgreSQL
+    NumpyVectorStore().export_from_db()